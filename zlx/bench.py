@@ -0,0 +1,437 @@
+from __future__ import absolute_import
+import io
+import os
+import random
+import re
+import struct
+import tempfile
+import time
+
+import zlx.int
+import zlx.io
+import zlx.wire
+
+def measure (func, min_time = 0.2):
+    '''
+    calls func repeatedly for at least min_time seconds;
+    returns the number of calls per second
+    '''
+    n = 0
+    batch = 1
+    start = time.time()
+    while True:
+        for i in range(batch): func()
+        n += batch
+        elapsed = time.time() - start
+        if elapsed >= min_time: return n / elapsed
+        batch *= 2
+
+def bench_result (name, ops, **extra):
+    r = dict(name = name, ops_per_sec = ops)
+    r.update(extra)
+    return r
+
+def throughput_result (name, ops, item_size, **extra):
+    return bench_result(name, ops, mb_per_sec = ops * item_size / 1e6, **extra)
+
+#* stream sources ***********************************************************
+class bench_sources (object):
+    '''
+    provides streams of different kinds over the same data:
+    io.BytesIO, zlx.io.ba_view, zlx.io.chunked_stream (4KiB chunks) and a
+    real file; use it as a context manager to clean up the temporary file
+    '''
+    CHUNK_SIZE = 4096
+
+    def __init__ (self, data):
+        self.data = data
+        f = tempfile.NamedTemporaryFile(delete = False)
+        f.write(data)
+        f.close()
+        self.path = f.name
+        self.files = []
+
+    def __enter__ (self): return self
+
+    def __exit__ (self, *exc):
+        for f in self.files: f.close()
+        os.unlink(self.path)
+
+    def open_file (self):
+        f = open(self.path, 'rb')
+        self.files.append(f)
+        return f
+
+    def open_chunked (self):
+        b = io.BytesIO(self.data)
+        return zlx.io.chunked_stream(zlx.io.chunk(b, o, min(self.CHUNK_SIZE, len(self.data) - o))
+                for o in range(0, len(self.data), self.CHUNK_SIZE))
+
+    def items (self):
+        return (
+            ('BytesIO', io.BytesIO(self.data)),
+            ('ba_view', zlx.io.ba_view(self.data)),
+            ('chunked_stream', self.open_chunked()),
+            ('file', self.open_file()))
+
+def make_bench_data (size, seed = 0):
+    rng = random.Random(seed)
+    return bytes(bytearray(rng.randrange(256) for i in range(size)))
+
+BENCH_DATA_SIZE = 0x10000
+
+#* int_codec_bench **********************************************************
+def int_codec_bench (min_time = 0.2):
+    '''
+    decode/encode throughput of each zlx.wire.INT_CODECS entry
+    '''
+    results = []
+    data = make_bench_data(BENCH_DATA_SIZE)
+    with bench_sources(data) as sources:
+        for codec in zlx.wire.INT_CODECS:
+            width = struct.calcsize(codec.pack_fmt)
+            count = len(data) // width
+            for src_name, src in sources.items():
+                def run (src = src, decode = codec.decode):
+                    src.seek(0)
+                    for i in range(count): decode(src)
+                ops = measure(run, min_time) * count
+                results.append(throughput_result('decode.' + codec.name, ops, width, source = src_name))
+            values = zlx.wire.stream_decode_array(io.BytesIO(data), codec, count)
+            def run (encode = codec.encode):
+                f = io.BytesIO()
+                for v in values: encode(f, v)
+            ops = measure(run, min_time) * count
+            results.append(throughput_result('encode.' + codec.name, ops, width, source = 'BytesIO'))
+            buf = bytearray(len(data))
+            ops = measure(lambda: codec.encode_into(buf, values), min_time) * count
+            results.append(throughput_result('encode_into.' + codec.name, ops, width, source = 'bytearray'))
+    return results
+
+#* record_codec_bench *******************************************************
+BENCH_FIXED_RECORD = zlx.wire.stream_record_codec('''
+bench_fixed_record:
+    u32le       a
+    u32le       b
+    u16le       c
+    u16le       d
+    u64le       e
+    u8          f
+    u8          g
+    u16be       h
+''')
+
+BENCH_VAR_RECORD = zlx.wire.stream_record_codec('''
+bench_var_record:
+    u8          n
+    u16le[n]    items
+    align[4]
+''')
+
+def record_codec_bench (min_time = 0.2):
+    '''
+    decode/encode throughput of a fixed-size and of a variable-size record
+    '''
+    results = []
+    data = make_bench_data(BENCH_DATA_SIZE)
+    fixed_size = BENCH_FIXED_RECORD.size
+    fixed_count = len(data) // fixed_size
+    f = io.BytesIO()
+    var_records = []
+    rng = random.Random(1)
+    while f.tell() < len(data):
+        n = rng.randrange(16)
+        r = BENCH_VAR_RECORD.record_type(n, tuple(rng.randrange(0x10000) for i in range(n)))
+        BENCH_VAR_RECORD.encode(f, r)
+        var_records.append(r)
+    var_data = f.getvalue()
+    var_count = len(var_records)
+    var_avg_size = len(var_data) / var_count
+    with bench_sources(data) as sources:
+        for src_name, src in sources.items():
+            def run (src = src, decode = BENCH_FIXED_RECORD.decode):
+                src.seek(0)
+                for i in range(fixed_count): decode(src)
+            ops = measure(run, min_time) * fixed_count
+            results.append(throughput_result('decode.fixed_record', ops, fixed_size, source = src_name))
+            def run (src = src):
+                src.seek(0)
+                for r in BENCH_FIXED_RECORD.iter_decode(src, fixed_count): pass
+            ops = measure(run, min_time) * fixed_count
+            results.append(throughput_result('iter_decode.fixed_record', ops, fixed_size, source = src_name))
+    with bench_sources(var_data) as sources:
+        for src_name, src in sources.items():
+            def run (src = src, decode = BENCH_VAR_RECORD.decode):
+                src.seek(0)
+                for i in range(var_count): decode(src)
+            ops = measure(run, min_time) * var_count
+            results.append(throughput_result('decode.var_record', ops, var_avg_size, source = src_name))
+    fixed_records = list(BENCH_FIXED_RECORD.iter_decode(io.BytesIO(data), fixed_count))
+    def run ():
+        f = io.BytesIO()
+        for r in fixed_records: BENCH_FIXED_RECORD.encode(f, r)
+    ops = measure(run, min_time) * fixed_count
+    results.append(throughput_result('encode.fixed_record', ops, fixed_size, source = 'BytesIO'))
+    buf = bytearray(len(data))
+    ops = measure(lambda: BENCH_FIXED_RECORD.encode_into(buf, fixed_records), min_time) * fixed_count
+    results.append(throughput_result('encode_into.fixed_record', ops, fixed_size, source = 'bytearray'))
+    def run ():
+        f = io.BytesIO()
+        for r in var_records: BENCH_VAR_RECORD.encode(f, r)
+    ops = measure(run, min_time) * var_count
+    results.append(throughput_result('encode.var_record', ops, var_avg_size, source = 'BytesIO'))
+    return results
+
+#* array_bench **************************************************************
+def array_bench (min_time = 0.2):
+    '''
+    bulk decoding of u32le / u16be arrays as tuples and as compact arrays
+    '''
+    results = []
+    data = make_bench_data(BENCH_DATA_SIZE)
+    with bench_sources(data) as sources:
+        for src_name, src in sources.items():
+            for codec in (zlx.wire.u32le, zlx.wire.u16be):
+                width = struct.calcsize(codec.pack_fmt)
+                count = len(data) // width
+                for compact in (False, True):
+                    def run (src = src, codec = codec, count = count, compact = compact):
+                        src.seek(0)
+                        zlx.wire.stream_decode_array(src, codec, count, compact)
+                    ops = measure(run, min_time) * count
+                    results.append(throughput_result(
+                        'decode_array.{}{}'.format(codec.name, '.compact' if compact else ''),
+                        ops, width, source = src_name))
+    return results
+
+#* magic_bench **************************************************************
+def linear_byte_seq_map_decode (stream, byte_seq_map):
+    '''
+    reference longest-match decoder that compares the data with every
+    byte sequence (how stream_decode_byte_seq_map used to work)
+    '''
+    max_len = max(len(k) for k in byte_seq_map)
+    data = stream.read(max_len)
+    match = None
+    for k in byte_seq_map:
+        if data[0:len(k)] == k:
+            if match is None or len(k) > len(match):
+                match = k
+    stream.seek((len(match) if match else 0) - len(data), 1)
+    return match
+
+def make_magics (count, seed = 0):
+    rng = random.Random(seed)
+    magics = set()
+    while len(magics) < count:
+        magics.add(bytes(bytearray(rng.randrange(256) for i in range(rng.randrange(2, 17)))))
+    return sorted(magics)
+
+def magic_bench (min_time = 0.2):
+    '''
+    compares magic_codec decoding against the linear scan for growing
+    numbers of magics
+    '''
+    results = []
+    for count in (10, 100, 500):
+        magics = make_magics(count)
+        codec = zlx.wire.magic_codec('!bench_magic', *magics)
+        samples = [io.BytesIO(m + b'tail' * 4) for m in magics[::max(1, count // 10)]]
+        def run_codec ():
+            for f in samples:
+                f.seek(0)
+                codec.decode(f)
+        def run_linear ():
+            for f in samples:
+                f.seek(0)
+                linear_byte_seq_map_decode(f, magics)
+        codec_ops = measure(run_codec, min_time) * len(samples)
+        linear_ops = measure(run_linear, min_time) * len(samples)
+        results.append(bench_result('magic_codec[{}]'.format(count), codec_ops,
+            linear_ops_per_sec = linear_ops,
+            speedup = codec_ops / linear_ops))
+    return results
+
+#* stream_cache_bench *******************************************************
+def linear_locate_block (blocks, offset):
+    '''
+    reference block lookup by linear scan (how stream_cache used to work)
+    '''
+    for i in range(len(blocks)):
+        b = blocks[i]
+        if offset >= b.offset and offset - b.offset < b.get_size():
+            return i, b
+    return len(blocks) - 1, blocks[-1]
+
+def make_fragmented_cache (fragment_count, fragment_size = 16):
+    '''
+    returns a stream_cache where every other fragment is cached so it holds
+    fragment_count cached blocks interleaved with uncached ones
+    '''
+    size = 2 * fragment_count * fragment_size
+    sc = zlx.io.stream_cache(io.BytesIO(bytes(bytearray(size))), align = fragment_size)
+    # loading from the end keeps the block list inserts cheap
+    for i in range(fragment_count - 1, -1, -1):
+        sc.load(2 * i * fragment_size, fragment_size)
+    return sc
+
+def stream_cache_bench (min_time = 0.2):
+    '''
+    block lookup, split and merge in a stream_cache with 100k fragments and
+    loading 16MiB in 4KiB steps
+    '''
+    results = []
+    fragment_count = 100000
+    fragment_size = 16
+    sc = make_fragmented_cache(fragment_count, fragment_size)
+    size = 2 * fragment_count * fragment_size
+    rng = random.Random(0)
+    offsets = [rng.randrange(size) for i in range(1000)]
+    def run ():
+        for o in offsets: sc.get_part(o, 1)
+    ops = measure(run, min_time) * len(offsets)
+    def run_linear ():
+        for o in offsets[0:10]: linear_locate_block(sc.blocks, o)
+    linear_ops = measure(run_linear, min_time) * 10
+    results.append(bench_result('get_part[{}]'.format(len(sc.blocks)), ops,
+        linear_ops_per_sec = linear_ops,
+        speedup = ops / linear_ops))
+    # each load fills a gap: splits an uncached block and merges neighbours
+    gaps = [(2 * i + 1) * fragment_size for i in rng.sample(range(fragment_count - 1), 1000)]
+    start = time.time()
+    for o in gaps: sc.load(o, fragment_size)
+    results.append(bench_result('load_merge[{}]'.format(len(sc.blocks)),
+        len(gaps) / (time.time() - start)))
+    # many small sequential loads merge into one growing cached block
+    data = bytes(bytearray(0x1000000))
+    step = 0x1000
+    start = time.time()
+    sc = zlx.io.stream_cache(zlx.io.ba_view(data), align = step)
+    for o in range(0, len(data), step): sc.load(o, step)
+    results.append(throughput_result('load_steps[{}]'.format(len(data) // step),
+        len(data) // step / (time.time() - start), step))
+    return results
+
+#* pe_bench *****************************************************************
+def make_pe_image (pe64 = False, section_count = 16, file_alignment = 0x200):
+    '''
+    builds a minimal PE32 / PE32+ image with section_count sections of
+    file_alignment bytes each
+    '''
+    import zlx.pe
+    lfanew = 0x80
+    opt_st = zlx.pe.OPT_HDR64_STRUCT if pe64 else zlx.pe.OPT_HDR32_STRUCT
+    opt_size = opt_st.size + zlx.pe.DATA_DIRECTORIES_STRUCT.size
+    sec_table = lfanew + 0x18 + opt_size
+    hsize = zlx.int.pow2_round_up(sec_table + section_count * zlx.pe.SECTION_HEADER_STRUCT.size, file_alignment)
+    image_size = 0x1000 * (section_count + 1)
+    b = bytearray(hsize + section_count * file_alignment)
+    b[0:2] = b'MZ'
+    struct.pack_into('<I', b, 0x3C, lfanew)
+    b[lfanew : lfanew + 4] = b'PE\0\0'
+    zlx.pe.FILE_HEADER_STRUCT.pack_into(b, lfanew + 4,
+        zlx.pe.MACHINE_AMD64 if pe64 else zlx.pe.MACHINE_I386, section_count,
+        0x5F000000, 0, 0, opt_size, zlx.pe.FH_EXECUTABLE_IMAGE)
+    head = (zlx.pe.OPT_HDR64_MAGIC if pe64 else zlx.pe.OPT_HDR32_MAGIC, 14, 0,
+        section_count * file_alignment, 0, 0, 0x1000, 0x1000)
+    tail = (0x1000, file_alignment, 6, 0, 0, 0, 6, 0, 0, image_size, hsize, 0,
+        zlx.pe.SUBSYSTEM_WINDOWS_CUI, 0, 0x100000, 0x1000, 0x100000, 0x1000, 0, 16)
+    if pe64: values = head + (0x140000000, ) + tail
+    else: values = head + (0x1000, 0x400000) + tail
+    opt_st.pack_into(b, lfanew + 0x18, *values)
+    zlx.pe.DATA_DIRECTORIES_STRUCT.pack_into(b, lfanew + 0x18 + opt_st.size,
+        *[x for i in range(16) for x in (0x1000 + 0x10 * i, 8 * i)])
+    for i in range(section_count):
+        fpos = hsize + i * file_alignment
+        zlx.pe.SECTION_HEADER_STRUCT.pack_into(b, sec_table + i * zlx.pe.SECTION_HEADER_STRUCT.size,
+            '.s{}'.format(i).encode('ascii'), file_alignment, 0x1000 * (i + 1), file_alignment, fpos,
+            0, 0, 0, 0, 0x40000040)
+        b[fpos : fpos + file_alignment] = bytearray([i + 1]) * file_alignment
+    return bytes(b)
+
+FIELD_CODECS = dict(B = 'u8', H = 'u16le', I = 'u32le', Q = 'u64le')
+
+def struct_field_layout (st):
+    '''
+    returns [(offset, codec name or byte count)] for the fields of a
+    little endian struct.Struct
+    '''
+    fmt = st.format if isinstance(st.format, str) else st.format.decode('ascii')
+    layout = []
+    o = 0
+    for count, ch in re.findall(r'(\d*)([a-zA-Z])', fmt):
+        count = int(count or 1)
+        if ch == 's':
+            layout.append((o, count))
+            o += count
+            continue
+        for i in range(count):
+            layout.append((o, FIELD_CODECS[ch]))
+            o += struct.calcsize('<' + ch)
+    return layout
+
+def fieldwise_unpack (ba, offset, layout):
+    return tuple(ba[offset + o, c] if isinstance(c, int) else getattr(ba, c)[offset + o] for o, c in layout)
+
+def fieldwise_parse_pe_header (ba, offset):
+    '''
+    reference parser reading every field with its own access (how
+    zlx.pe.parse_pe_header used to work)
+    '''
+    import zlx.pe
+    peh = zlx.pe.PEHeader(magic = ba.u32le[offset])
+    peh.file_hdr = zlx.pe.FileHeader(*fieldwise_unpack(ba, offset + 4, struct_field_layout(zlx.pe.FILE_HEADER_STRUCT)))
+    o = offset + 24
+    magic = ba.u16le[o]
+    if magic == zlx.pe.OPT_HDR64_MAGIC: rec_type, st = zlx.pe.OptionalHeader64, zlx.pe.OPT_HDR64_STRUCT
+    else: rec_type, st = zlx.pe.OptionalHeader32, zlx.pe.OPT_HDR32_STRUCT
+    peh.opt_hdr = rec_type(*fieldwise_unpack(ba, o, struct_field_layout(st)))
+    peh.opt_hdr.dir = tuple(zlx.pe.DataDirectory(ba.u32le[o + st.size + 8 * i], ba.u32le[o + st.size + 8 * i + 4])
+        for i in range(16))
+    sec_layout = struct_field_layout(zlx.pe.SECTION_HEADER_STRUCT)
+    peh.sec = tuple(zlx.pe.SectionHeader(*fieldwise_unpack(ba,
+            offset + 0x18 + peh.file_hdr.opt_hdr_size + i * 0x28, sec_layout))
+        for i in range(peh.file_hdr.section_count))
+    return peh
+
+PE_EXTENSIONS = ('.exe', '.dll', '.sys', '.efi')
+
+def pe_corpus ():
+    '''
+    returns [(name, data)]: synthetic PE32 / PE32+ images plus the PE files
+    listed in ZLX_PE_CORPUS (paths to files or directories, separated by
+    os.pathsep)
+    '''
+    corpus = [('synthetic32', make_pe_image(False)), ('synthetic64', make_pe_image(True))]
+    paths = []
+    for p in os.environ.get('ZLX_PE_CORPUS', '').split(os.pathsep):
+        if os.path.isdir(p):
+            paths.extend(os.path.join(p, n) for n in sorted(os.listdir(p)) if n.lower().endswith(PE_EXTENSIONS))
+        elif p:
+            paths.append(p)
+    for p in paths:
+        data = zlx.io.bin_load(p)
+        if data[0:2] == b'MZ': corpus.append((os.path.basename(p), data))
+    return corpus
+
+def pe_bench (min_time = 0.2):
+    '''
+    parse_pe_header against the per-field reference parser over the corpus
+    of pe_corpus(), from buffers and from streams
+    '''
+    import zlx.pe
+    results = []
+    corpus = pe_corpus()
+    for src_name, wrap in (('buffer', lambda data: data), ('BytesIO', io.BytesIO)):
+        items = []
+        for name, data in corpus:
+            ba = zlx.wire.stream(wrap(data))
+            items.append((ba, zlx.pe.parse_mz_header(ba).e_lfanew))
+        def run (parse):
+            for ba, offset in items: parse(ba, offset)
+        ops = measure(lambda: run(zlx.pe.parse_pe_header), min_time) * len(items)
+        fieldwise_ops = measure(lambda: run(fieldwise_parse_pe_header), min_time) * len(items)
+        results.append(bench_result('parse_pe_header', ops, source = src_name, files = len(items),
+            fieldwise_ops_per_sec = fieldwise_ops,
+            speedup = ops / fieldwise_ops))
+    return results
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 import argparse
 import io
 import sys
+import time
 import traceback
 import zlx.record
 import zlx.io
@@ -55,11 +56,22 @@ def cmd_inc_build (req):
         inc(path = path, save_path = path, pattern = req.prefix)
 
 def cmd_test_stream_cache (req):
+    store = zlx.io.stream_cache_store(req.store, req.FILE) if req.store else None
+    commands = list(req.commands)
+    if req.replay:
+        with open(req.replay, 'r') as f:
+            commands.extend(l.strip() for l in f if l.strip() and not l.startswith('#'))
+    trace = open(req.trace, 'w') if req.trace else None
     with open(req.FILE, 'rb') as f:
         sc = zlx.io.stream_cache(f,
                 align = req.alignment,
-                assume_size = req.assume_size)
-        for c in req.commands:
+                assume_size = req.assume_size,
+                store = store,
+                probe_holes = req.probe_holes,
+                max_cached_bytes = req.max_cached_bytes,
+                max_read_ahead = req.max_read_ahead,
+                trace = trace)
+        for c in commands:
             dmsg('*** {!r}', sc)
             cparts = c.split(':')
             verb = cparts[0]
@@ -69,6 +81,11 @@ def cmd_test_stream_cache (req):
                 dmsg('--- get(offset={}, size={})', ofs, size)
                 blk_list = sc.get(ofs, size)
                 dmsg('==> block: {!r}', blk_list)
+            elif verb == 'part':
+                ofs, size = (int(x) for x in args)
+                dmsg('--- get_part(offset={}, size={})', ofs, size)
+                blk = sc.get_part(ofs, size)
+                dmsg('==> block: {!r}', blk)
             elif verb == 'load':
                 ofs, size = (int(x) for x in args)
                 dmsg('--- load(offset={}, size={})', ofs, size)
@@ -76,6 +93,18 @@ def cmd_test_stream_cache (req):
             else:
                 raise RuntimeError(sfmt('unsupported verb {!r}', verb))
         dmsg('*** {!r}', sc)
+        print_stream_cache_stats(sc.stats())
+    if trace: trace.close()
+    if store: store.close()
+
+def print_stream_cache_stats (stats):
+    lat = stats.pop('load_latency')
+    omsg('stream_cache stats:')
+    for k in sorted(stats):
+        omsg('  {:<20} {}', k, stats[k])
+    omsg('  load latency:        count={} total={:.6f}s max={:.6f}s', lat['count'], lat['total_sec'], lat['max_sec'])
+    for us, n in lat['buckets_us']:
+        omsg('    < {:>9} us: {}', us, n)
 
 def cmd_test_mth (req):
     import zlx.mth
@@ -151,10 +180,129 @@ def wire_test ():
     assert o.bbb == 0x69686766
     assert o.ccc == 0x6A
     assert o.magic == b'ABC\n'
+    # aaa (big endian) cannot share a struct with bbb/ccc (little endian)
+    assert [st.format if st else None for st, f in ABC.steps] == [None, '>H', '<IB']
+    f = io.BytesIO()
+    ABC.encode(f, o)
+    assert f.getvalue() == b'ABC\ndefghij'
+    try:
+        ABC.decode(io.BytesIO(b'ABC\ndefghi'))
+        assert False
+    except zlx.wire.decode_error as e:
+        assert 'truncated data' in e.args
 
     s = zlx.wire.stream(b'0123456789', *zlx.wire.INT_CODECS)
     print('bla {}'.format(s.u32be[1]))
     assert s.u8[3] == 0x33
+    assert s.u16be[1, 2] == (0x3132, 0x3334)
+    assert s.read(3) == b'012' and s.read(2) == b'34'
+
+    f = io.BytesIO(b'ABC\ndefghijABC\nklmnopq-')
+    l = list(ABC.iter_decode(f, 2, chunk_size = 5))
+    assert [x.ccc for x in l] == [0x6A, 0x71] and f.read() == b'-'
+    f = io.BytesIO(b'ABC\ndefghij')
+    assert len(list(ABC.iter_decode(f))) == 1
+    assert list(zlx.wire.u16le.iter_decode(io.BytesIO(b'\1\0\2\0\3\0'), chunk_size = 4)) == [1, 2, 3]
+    try:
+        list(zlx.wire.u16le.iter_decode(io.BytesIO(b'\1\0\2')))
+        assert False
+    except zlx.wire.decode_error as e:
+        assert 'truncated data' in e.args
+
+    V = zlx.wire.stream_record_codec('''
+        V:
+            u8              n
+            u16le[n]        items
+            bytes[n]        name
+            align[4]
+            u8              tail
+            ''')
+    assert V.field_offsets == dict(n = 0, items = 1, name = None, tail = None)
+    data = b'\2\1\0\2\0ab\0X'
+    v = V.decode(io.BytesIO(data))
+    assert (v.n, v.items, v.name, v.tail) == (2, (1, 2), b'ab', 0x58)
+    f = io.BytesIO()
+    V.encode(f, v)
+    assert f.getvalue() == data
+    v.items = (1, 2, 3)
+    try:
+        V.encode(io.BytesIO(), v)
+        assert False
+    except zlx.wire.encode_error as e:
+        pass
+    H = zlx.wire.stream_record_codec('H:\n u8 a\n align[4]\n bytes[2] b\n u16le[2] c\n')
+    assert H.size == 10 and H.field_offsets == dict(a = 0, b = 4, c = 6)
+    assert [st.format if st else None for st, f in H.steps] == ['<B3x2s', None]
+    h = H.decode(io.BytesIO(b'\7xxxab\1\0\2\0'))
+    assert (h.a, h.b, h.c) == (7, b'ab', (1, 2))
+    for bad in (b'abcdef', b'a'):
+        h.b = bad
+        for enc in (lambda: H.encode(io.BytesIO(), h), lambda: H.encode_into(bytearray(10), [h])):
+            try:
+                enc()
+                assert False
+            except zlx.wire.encode_error as e:
+                assert 'expecting length 2' in e.args[0]
+    try:
+        zlx.wire.stream_record_codec('X:\n u8 a\n u32le\n')
+        assert False
+    except RuntimeError as e:
+        assert 'bad record spec' in e.args[0]
+    L = zlx.wire.stream_record_codec('L:\n u8 n\n bytes[n] data\n u8 tail\n')
+    assert L.field_offsets == dict(n = 0, data = 1, tail = None) and L.size is None
+    l = L.decode(io.BytesIO(b'\3abcZ'))
+    assert (l.n, l.data, l.tail) == (3, b'abc', 0x5A)
+    f = io.BytesIO()
+    L.encode(f, l)
+    assert f.getvalue() == b'\3abcZ'
+
+    buf = bytearray(b'-' * 8)
+    assert zlx.wire.u16be.encode_into(buf, [1, 2, 3], 1) == 6
+    assert buf == b'-\0\1\0\2\0\3-'
+    assert V.encode_into(memoryview(buf), [V.record_type(1, (5,), b'z', 7)], 0) == 5
+    assert buf == b'\1\5\0z\7\0\3-'
+    try:
+        zlx.wire.u32le.encode_into(buf, [1, 2, 3])
+        assert False
+    except zlx.wire.encode_error as e:
+        pass
+
+    XY = zlx.wire.stream_record_codec('XY', field('x', zlx.wire.u16le), field('y', zlx.wire.u32be))
+    assert ABC.view_type is None and XY.size == 6
+    v = XY.view(b'--\x01\x02\0\0\0\x03', 2)
+    assert v.y == 3 and v.__dict__['y'] == 3 and 'x' not in v.__dict__
+    assert v.x == 0x201
+    assert XY.view(io.BytesIO(b'\1\0\0\0\0\2'), cache = False).y == 2
+    l = list(XY.iter_decode(io.BytesIO(b'\1\0\0\0\0\2' * 3), chunk_size = 8))
+    assert [(r.x, r.y) for r in l] == [(1, 2)] * 3
+    buf = bytearray(12)
+    assert XY.encode_into(buf, l[0:2]) == 12 and buf == b'\1\0\0\0\0\2' * 2
+    try:
+        XY.view(b'\1\0\0\0\0')
+        assert False
+    except zlx.wire.decode_error as e:
+        assert 'truncated data' in e.args
+
+    s = zlx.wire.stream(memoryview(b'\x01\x02\x03\x04\x05'))
+    assert s.u32le[1] == 0x05040302
+    assert s[1, 2] == b'\x02\x03' and s[4] == 5 and len(s) == 5
+    try:
+        s.u32le[2]
+        assert False
+    except zlx.wire.decode_error as e:
+        assert 'truncated data' in e.args
+
+    f = io.BytesIO(b'\x01\x00\x02\x00\x03\x00-')
+    a = zlx.wire.stream_decode_array(f, zlx.wire.u16le, 3, compact = True)
+    assert list(a) == [1, 2, 3] and f.read() == b'-'
+    a = zlx.wire.stream_decode_array(io.BytesIO(b'\0\1\0\2'), zlx.wire.u16be, 2, compact = True)
+    assert list(a) == [1, 2]
+    assert zlx.wire.stream_decode_array(io.BytesIO(b'\xFF\xFE'), zlx.wire.i8, 2) == (-1, -2)
+    try:
+        zlx.wire.stream_decode_array(io.BytesIO(b'\0\1\0'), zlx.wire.u16be, 2)
+        assert False
+    except zlx.wire.decode_error as e:
+        assert 'truncated data' in e.args
     return
 
 def io_test ():
@@ -166,6 +314,15 @@ def io_test ():
     r = cs.read(12)
     print(repr(r))
     assert r == b'12345FGHIJ34'
+    cs.seek(3)
+    assert [cs.read(4) for i in range(4)] == [b'45FG', b'HIJ3', b'45', b'']
+    cs.seek(9)
+    b = bytearray(2)
+    assert cs.readinto(memoryview(b)) == 2 and b == b'J3'
+    cs = zlx.io.chunked_stream((zlx.io.chunk(b1, 1, 2), zlx.io.chunk(b1, 3, 0),
+        zlx.io.chunk(b1, 3, 4), zlx.io.chunk(b2, 7, 1), zlx.io.chunk(b2, 8, 1)))
+    assert cs.run_count == 2 and cs.size == 8
+    assert cs.read() == b'123456HI'
 
     ba = bytearray(b'012345')
     bav = zlx.io.ba_view(ba)
@@ -174,6 +331,283 @@ def io_test ():
     assert bav.read(5) == b'345'
     return
 
+def make_test_msf7 ():
+    import struct
+    import zlx.msf7
+    bs = 0x200
+    blocks = [bytearray(bs) for i in range(7)]
+    blocks[0][0:len(zlx.msf7.MAGIC) + 24] = zlx.msf7.MAGIC + struct.pack('<6I', bs, 1, 7, 24, 0, 2)
+    blocks[2][0:4] = struct.pack('<I', 3)
+    blocks[3][0:20] = struct.pack('<5I', 2, 5, 0x300, 4, 5) # stream 1 block list continues
+    blocks[3][20:24] = struct.pack('<I', 6)
+    blocks[4][0:5] = b'hello'
+    blocks[5][:] = b'A' * bs
+    blocks[6][:] = b'B' * bs
+    return bytes(b''.join(blocks))
+
+def msf7_test ():
+    import zlx.msf7
+    for source in (io.BytesIO(make_test_msf7()), memoryview(make_test_msf7())):
+        check_msf7_reader(zlx.msf7.reader(source))
+
+def check_msf7_reader (mr):
+    assert mr.superblock.block_size == 0x200
+    mr.load_dir()
+    assert mr.stream_count == 2
+    assert list(mr.stream_size_table) == [5, 0x300]
+    assert mr.streams[0].read(5) == b'hello'
+    assert mr.streams[1].read(0x300) == b'A' * 0x200 + b'B' * 0x100
+    assert mr.streams[1].stream.run_count == 1
+
+def stream_cache_test ():
+    import gzip
+    import os
+    import shutil
+    import tempfile
+    import zlx.io
+    import zlx.wire
+    data = bytes(bytearray(range(256))) * 64
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        ps = zlx.io.pread_stream(f)
+        f.seek(5)
+        ps.seek(0x1FE)
+        assert ps.read(4) == b'\xFE\xFF\x00\x01' and f.tell() == 5
+        assert ps.seek(0, io.SEEK_END) == len(data)
+
+        r = zlx.io.rope((b'0123', memoryview(bytearray(b'456789'))))
+        tail = r.split(6)
+        assert r.tobytes() == b'012345' and tail.tobytes() == b'6789' and len(r.segments) == 2
+        r.extend(tail)
+        r.replace(3, b'abc')
+        assert r.tobytes() == b'012abc6789' and len(r) == 10
+        assert bytes(r.slice(4, 100)) == b'bc6789' and bytes(r[1:3]) == b'12'
+        assert r.slice(3, 3).obj is r.segments[1] # no copy within a segment
+
+        sc = zlx.io.stream_cache(open(f.name, 'rb'), align = 0x100, positional = True)
+        g = open(os.devnull, 'rb') # would reuse the fd if the first file got collected
+        sc.load(0, 0x10)
+        assert bytes(sc.get(0, 0x10)[0].data) == data[0:0x10]
+        g.close()
+        gz = io.BytesIO()
+        with gzip.GzipFile(fileobj = gz, mode = 'wb') as z: z.write(data)
+        gz.seek(0)
+        with open(f.name + '.gz', 'wb') as z: z.write(gz.getvalue())
+        try:
+            with gzip.open(f.name + '.gz', 'rb') as z:
+                sc = zlx.io.stream_cache(z, align = 0x100, positional = True, probe_holes = True)
+                sc.load(0, 0x10)
+                assert not isinstance(sc.stream, zlx.io.pread_stream) and bytes(sc.get(0, 0x10)[0].data) == data[0:0x10]
+        finally:
+            os.unlink(f.name + '.gz')
+
+        sc = zlx.io.stream_cache(f, align = 0x100, positional = True)
+        assert isinstance(sc.stream, zlx.io.pread_stream)
+        sc.load(0x150, 0x100)
+        assert f.tell() == 5
+        l = sc.get(0, 0x400)
+        assert [b.kind for b in l] == [zlx.io.SCK_UNCACHED, zlx.io.SCK_CACHED, zlx.io.SCK_UNCACHED]
+        assert l[1].offset == 0x100 and bytes(l[1].data) == data[0x100:0x300]
+        sc.load(0x3F00, 0x1000)
+        assert sc.get(0x3FFF, 2)[-1].kind == zlx.io.SCK_HOLE
+
+        sc = zlx.io.stream_cache(f, align = 0x100, max_cached_bytes = 0x300)
+        sc.load(0, 0x200)
+        sc.load(0x1000, 0x100)
+        sc.get(0, 0x10) # page 0 becomes most recently used
+        sc.load(0x2000, 0x100) # evicts page 1
+        assert sc.cached_bytes == 0x300 and sc.evicted_bytes == 0x100
+        assert [b.kind for b in sc.get(0, 0x200)] == [zlx.io.SCK_CACHED, zlx.io.SCK_UNCACHED]
+        sc.load(0x100, 0x100) # evicts page 0x10
+        assert sc.reloaded_bytes == 0x100 and sc.evicted_bytes == 0x200
+        assert sc.get(0x1000, 1)[0].kind == zlx.io.SCK_UNCACHED
+        assert bytes(sc.get(0, 0x200)[0].data) == data[0:0x200]
+        sc = zlx.io.stream_cache(f, align = 0x100, max_cached_bytes = 0x500)
+        sc.load(0, 0x400)
+        sc.load(0x2000, 0x100)
+        for i in range(10): sc.get(0, 0x400) # refreshes all 4 pages
+        sc.load(0x3000, 0x100) # evicts the cold page
+        assert [b.kind for b in sc.get(0, 0x400)] == [zlx.io.SCK_CACHED]
+        assert sc.get(0x2000, 1)[0].kind == zlx.io.SCK_UNCACHED
+        lru = zlx.io.page_lru()
+        lru.add(0, 9)
+        lru.use(3, 5)
+        lru.use(8, 8)
+        lru.use(0, 1)
+        assert [lru.pop() for i in range(11)] == [2, 6, 7, 9, 3, 4, 5, 8, 0, 1, None]
+        sc = zlx.io.stream_cache(f, align = 0x100, max_cached_bytes = 0x200)
+        sc.load(0, 0x1000) # one read buffer, all but 2 pages evicted
+        segs = [seg for b in sc.blocks if b.kind == zlx.io.SCK_CACHED for seg in b.data.segments]
+        held = sum(memoryview(getattr(seg, 'obj', seg)).nbytes for seg in segs)
+        assert sum(len(seg) for seg in segs) == 0x200 and held <= 0x400, held
+        assert bytes(sc.get(0xE00, 0x200)[0].data) == data[0xE00:0x1000]
+
+        trace = io.StringIO()
+        sc = zlx.io.stream_cache(f, align = 0x100, trace = trace)
+        sc.load(0x100, 0x10)
+        sc.load(0x100, 0x10) # cached already: no I/O
+        sc.get(0, 0x400)
+        st = sc.stats()
+        assert (st['get_hits'], st['get_misses'], st['get_holes'], st['fragments']) == (1, 2, 0, 1)
+        assert (st['load_count'], st['loaded_bytes'], st['peak_cached_bytes']) == (1, 0x100, 0x100)
+        assert st['load_latency']['count'] == 1 and sum(n for us, n in st['load_latency']['buckets_us']) == 1
+        assert trace.getvalue().split() == ['load:256:16', 'load:256:16', 'part:0:1024', 'part:256:768', 'part:512:512']
+
+        sc = zlx.io.stream_cache(f, align = 0x100, max_read_ahead = 0x400)
+        for o in range(0, 0x300, 0x100): sc.load(o, 0x100)
+        assert [(b.kind, b.get_size()) for b in sc.get(0, 0x600)] == [(zlx.io.SCK_CACHED, 0x500), (zlx.io.SCK_UNCACHED, 0x100)]
+        sc.load(0x3000, 0x10)
+        assert [(b.kind, b.get_size()) for b in sc.get(0x3000, 0x200)] == [(zlx.io.SCK_CACHED, 0x100), (zlx.io.SCK_UNCACHED, 0x100)]
+        ra = zlx.io.read_ahead_policy(0x10, 0x100)
+        assert [ra.update(o, 4) for o in (0x1000, 0x1400, 0x1800, 0x1C00)] == [[], [], [(0x1C00, 4)], [(0x2000, 4)]]
+
+        cs = zlx.io.cached_stream(zlx.io.stream_cache(f, align = 0x100, max_cached_bytes = 0x400))
+        cs.seek(0x1F0)
+        assert cs.read(0x800) == data[0x1F0:0x9F0] and cs.tell() == 0x9F0
+        assert cs.source.cached_bytes <= 0x400
+        assert zlx.wire.stream(cs).u32le[0x3FFC] == 0xFFFEFDFC
+        assert cs.seek(-2, io.SEEK_END) == len(data) - 2 and cs.read(8) == b'\xFE\xFF' and cs.read(8) == b''
+        class unseekable (io.RawIOBase):
+            def __init__ (self, f): self.f = f
+            def readable (self): return True
+            def readinto (self, b): return zlx.io.stream_readinto(self.f, b)
+        cs = zlx.io.cached_stream(zlx.io.stream_cache(unseekable(io.BytesIO(data[0:0x300]))))
+        assert cs.read(0x10) == data[0:0x10] and cs.read() == data[0x10:0x300]
+        cs.seek(0x20)
+        assert cs.read(4) == data[0x20:0x24]
+
+        import zlx.mth
+        wm = zlx.mth.worker_manager(init_worker_count = 4)
+        try:
+            sc = zlx.io.stream_cache(zlx.io.pread_stream(f), align = 0x100, assume_size = len(data) + 0x1880,
+                    io_workers = wm, io_chunk_size = 0x1000)
+            sc.load(0x80, len(data) + 0x2000)
+            assert [b.kind for b in sc.get(0, len(data) + 1)] == [zlx.io.SCK_CACHED, zlx.io.SCK_HOLE]
+            assert bytes(sc.get(0, len(data))[0].data) == data and sc.get_known_end_offset() == len(data)
+        finally:
+            wm.shutdown()
+
+        srv = zlx.io.stream_cache_server(init_worker_count = 0, max_worker_count = 0)
+        scp = srv.wrap(zlx.io.stream_cache(f, align = 0x100))
+        for o, n in ((0x400, 0x10), (0x180, 0x100), (0x1000, 0x100), (0x200, 0x10)):
+            scp.get(o, n)
+        assert scp.load_queue == [(0x100, 0x200), (0x400, 0x100), (0x1000, 0x100)]
+        scp.get(0x280, 0x100)
+        assert scp.load_queue == [(0x100, 0x400), (0x1000, 0x100)] and len(srv.stream_queue) == 1
+        assert scp.merged_bytes == 0x200
+        scp.work_()
+        assert [b.kind for b in scp.get(0x100, 0x400)] == [zlx.io.SCK_CACHED] and not scp.load_queue
+        cs = zlx.io.cached_stream(scp)
+        cs.seek(0x2000)
+        assert cs.read(0x200) == data[0x2000:0x2200] and not scp.load_queue # synchronous reads queue nothing
+        scp = srv.wrap(zlx.io.stream_cache(f, align = 0x100), max_read_ahead = 0x1000)
+        parts = sum(len(scp.get(o, 0x10)) for o in range(0, 0x1000, 0x100))
+        st = scp.stats()
+        # the read-ahead probes are not counted as accesses
+        assert (st['get_hits'], st['get_misses']) == (0, parts) and scp.load_queue == [(0, 0x2000)]
+        srv.shutdown()
+
+        try:
+            import asyncio
+        except ImportError:
+            asyncio = None
+        if asyncio is not None:
+            srv = zlx.io.stream_cache_server(init_worker_count = 2)
+            scp = srv.wrap(zlx.io.stream_cache(f, align = 0x100), delay = 0.01)
+            loop = asyncio.new_event_loop()
+            l = loop.run_until_complete(asyncio.gather(*[scp.aget(o, 0x180, loop) for o in (0, 0x100, 0x3F80)]))
+            loop.close()
+            srv.shutdown()
+            assert [[b.kind for b in a] for a in l] == [[zlx.io.SCK_CACHED]] * 2 + [[zlx.io.SCK_CACHED, zlx.io.SCK_HOLE]]
+            assert bytes(l[1][0].data) == data[0x100:0x280] and not scp.waiters
+
+            class flaky (io.BytesIO):
+                fail = 1
+                def read (self, *a):
+                    if self.fail:
+                        self.fail -= 1
+                        raise IOError('transient')
+                    return io.BytesIO.read(self, *a)
+            srv = zlx.io.stream_cache_server(init_worker_count = 1, max_worker_count = 1)
+            scp = srv.wrap(zlx.io.stream_cache(flaky(data), align = 0x100), delay = 0.05)
+            loop = asyncio.new_event_loop()
+            err = sys.stderr
+            sys.stderr = io.StringIO() # the worker reports the failed load
+            try:
+                l = loop.run_until_complete(asyncio.gather(scp.aget(0, 0x10, loop), scp.aget(0x2000, 0x10, loop), return_exceptions = True))
+            finally:
+                sys.stderr = err
+            # only the waiter on the failed range gets the error
+            assert isinstance(l[0], IOError) and bytes(l[1][0].data) == data[0x2000:0x2010]
+            l = loop.run_until_complete(asyncio.wait_for(scp.aget(0, 0x10, loop), 5))
+            assert bytes(l[0].data) == data[0:0x10]
+            fut = scp.aget(0x1000, 0x10, loop)
+            srv.shutdown()
+            try:
+                loop.run_until_complete(asyncio.wait_for(fut, 5))
+                assert False
+            except zlx.io.stream_cache_server_down:
+                pass
+            loop.close()
+
+        store_dir = tempfile.mkdtemp()
+        try:
+            store_path = os.path.join(store_dir, 'cache')
+            with zlx.io.stream_cache_store(store_path, f.name) as st:
+                sc = zlx.io.stream_cache(f, align = 0x100, store = st)
+                sc.load(0x100, 0x100)
+                sc.load(0x3F00, 0x200)
+            assert os.path.getsize(store_path) == len(data)
+            # the stored ranges come back from the store, not from the stream
+            with zlx.io.stream_cache_store(store_path, f.name) as st:
+                assert st.ranges == [(0x100, 0x100), (0x3F00, 0x100)]
+                sc = zlx.io.stream_cache(io.BytesIO(bytes(bytearray(len(data)))), align = 0x100, store = st)
+                assert [b.kind for b in sc.get(0, 0x300)] == [zlx.io.SCK_UNCACHED, zlx.io.SCK_CACHED, zlx.io.SCK_UNCACHED]
+                assert bytes(sc.get(0x3F00, 0x100)[0].data) == data[0x3F00:]
+                sc.load(0x80, 0x100)
+                assert bytes(sc.get(0, 0x200)[0].data) == bytes(bytearray(0x100)) + data[0x100:0x200]
+                assert sc.store_loaded_bytes == 0 # mapped, not read
+            with open(store_path + '.map', 'r+b') as m:
+                m.truncate(os.path.getsize(store_path + '.map') - 5)
+            with zlx.io.stream_cache_store(store_path, f.name) as st:
+                assert st.ranges == [] # a damaged map is stale
+            st = os.stat(f.name)
+            os.utime(f.name, (st.st_atime, st.st_mtime + 10))
+            with zlx.io.stream_cache_store(store_path, f.name) as st:
+                assert st.ranges == []
+        finally:
+            shutil.rmtree(store_dir)
+
+    with tempfile.NamedTemporaryFile() as f:
+        # sparse file: data at 0 and 1MiB, holes elsewhere up to 3MiB
+        f.write(b'A' * 0x1000)
+        f.seek(0x100000)
+        f.write(b'B' * 0x1000)
+        f.truncate(0x300000)
+        f.flush()
+        holes = zlx.io.find_holes(f.fileno(), 0x300000)
+        if holes: # the file system reports holes
+            assert holes[0][0] == 0x1000 and holes[-1][0] + holes[-1][1] == 0x300000
+            sc = zlx.io.stream_cache(f, probe_holes = True, positional = True)
+            assert sc.hole_bytes == sum(n for o, n in holes) and sc.get_known_end_offset() == 0x300000
+            sc.load(0, 0x300000)
+            assert sc.cached_bytes == 0x300000 - sc.hole_bytes
+            cs = zlx.io.cached_stream(sc)
+            assert cs.read(0x1000) == b'A' * 0x1000 and cs.read(0xFF000) == bytes(bytearray(0xFF000))
+            assert cs.read(0x1001) == b'B' * 0x1000 + b'\0'
+            sc._update_data(0x200000, b'C') # data showing up in a hole
+            sc._update_no_data(0x280000) # ... and the file getting shorter
+            assert [b.kind for b in sc.get(0x1FFFFF, 0x100000)] == [zlx.io.SCK_HOLE, zlx.io.SCK_CACHED, zlx.io.SCK_HOLE, zlx.io.SCK_HOLE]
+            assert sc.get_known_end_offset() == 0x280000
+
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        m = zlx.io.map_file(f.name)
+        assert len(m) == len(data) and m[0x1FF] == 0xFF
+        assert zlx.wire.stream(m).u16be[0x1FE] == 0xFEFF
+
 def linear_data_cache_test ():
     import zlx.io
     zlx.io.linear_data_cache_test()
@@ -204,6 +638,26 @@ def pe_test ():
     assert x.magic == zlx.pe.MZ_MAGIC
     assert x.e_lfanew == 0x80
 
+    import zlx.bench
+    for pe64 in (False, True):
+        data = zlx.bench.make_pe_image(pe64, section_count = 3)
+        for ba in (zlx.wire.stream(data), zlx.wire.stream(io.BytesIO(data))):
+            peh = zlx.pe.parse_pe_header(ba, zlx.pe.parse_mz_header(ba).e_lfanew)
+            assert peh.magic == zlx.pe.PE_MAGIC and peh.file_hdr.section_count == 3
+            assert peh.opt_hdr.magic == (zlx.pe.OPT_HDR64_MAGIC if pe64 else zlx.pe.OPT_HDR32_MAGIC)
+            assert peh.opt_hdr.image_base == (0x140000000 if pe64 else 0x400000)
+            assert (peh.opt_hdr.subsystem, peh.opt_hdr.dir_count, peh.opt_hdr.size_of_heap_commit) == (zlx.pe.SUBSYSTEM_WINDOWS_CUI, 16, 0x1000)
+            assert [(d.rva, d.size) for d in peh.opt_hdr.dir[0:2]] == [(0x1000, 0), (0x1010, 8)]
+            assert [s.name for s in peh.sec] == [b'.s0\0\0\0\0\0', b'.s1\0\0\0\0\0', b'.s2\0\0\0\0\0']
+            assert repr(peh) == repr(zlx.bench.fieldwise_parse_pe_header(ba, 0x80))
+            image = zlx.pe.map_parsed_pe(ba, peh)
+            assert len(image) == 0x4000 and image[0x2000] == 2 and image[0:2] == b'MZ'
+    try:
+        zlx.pe.parse_pe_header(zlx.wire.stream(data[0:0x100]), 0x80)
+        assert False
+    except zlx.wire.decode_error as e:
+        assert 'truncated data' in e.args
+
 def xref_test ():
     import zlx.bin
     import zlx.wire
@@ -227,6 +681,31 @@ def cmd_test (req):
         print('calling test {!r}'.format(var))
         globals()[var]()
 
+def cmd_bench (req):
+    import json
+    import platform
+    import zlx.bench
+    names = sorted(n for n in dir(zlx.bench) if n.endswith('_bench'))
+    if req.BENCH: names = [n for n in names if n[:-6] in req.BENCH or n in req.BENCH]
+    results = []
+    for name in names:
+        omsg('running {}...', name)
+        for r in getattr(zlx.bench, name)(min_time = req.min_time):
+            r['bench'] = name
+            results.append(r)
+            extra = ' '.join('{}={:.6g}'.format(k, v) if isinstance(v, float) else '{}={}'.format(k, v)
+                    for k, v in sorted(r.items()) if k not in ('name', 'ops_per_sec', 'bench'))
+            omsg('  {:<32} {:>14.1f} ops/s  {}', r['name'], r['ops_per_sec'], extra)
+    if req.output:
+        with open(req.output, 'w') as f:
+            json.dump(dict(
+                zlx_version = zlx.VER_STR,
+                python = platform.python_version(),
+                platform = platform.platform(),
+                time = time.time(),
+                min_time = req.min_time,
+                results = results), f, indent = 1, sort_keys = True)
+
 def main (args):
     ap = argparse.ArgumentParser(
             description='tool to process binary and text data')
@@ -266,13 +745,44 @@ def main (args):
             type = int,
             help='init caching to assume the given size',
             default = None)
+    p.add_argument('-H', '--probe-holes',
+            action = 'store_true',
+            help = 'record the holes of sparse files (SEEK_DATA/SEEK_HOLE)')
+    p.add_argument('-m', '--max-cached-bytes',
+            type = int,
+            help = 'evict least recently used pages over this budget',
+            default = None)
+    p.add_argument('-R', '--max-read-ahead',
+            type = int,
+            help = 'read ahead of sequential / strided loads up to this size',
+            default = 0)
+    p.add_argument('-r', '--replay',
+            help = 'run the commands from this trace file (one per line) after the given ones',
+            default = None)
+    p.add_argument('-w', '--trace',
+            help = 'record get / load calls to this trace file',
+            default = None)
+    p.add_argument('-s', '--store',
+            help = 'persist cached data to this file (and its .map sidecar)',
+            default = None)
     p.add_argument('commands',
             nargs = '*',
-            help = '"get:<offset>:<size>" or "load:<offset>:<size>"')
+            help = '"get:<offset>:<size>", "part:<offset>:<size>" (get_part) or "load:<offset>:<size>"')
 
     p = sp.add_parser('test-mth',
             help = 'tests zlx.mth module')
 
+    p = sp.add_parser('bench',
+            help = 'runs benchmarks from zlx.bench')
+    p.add_argument('BENCH', nargs = '*',
+            help = 'benchmarks to run (default: all), e.g. "magic"')
+    p.add_argument('-t', '--min-time', dest = 'min_time', type = float,
+            help = 'minimum time in seconds to spend per measurement',
+            default = 0.2)
+    p.add_argument('-o', '--output', dest = 'output',
+            help = 'write results as JSON to the given file',
+            default = None)
+
     req = ap.parse_args(args[1:])
     if req.verbose:
         print('command line: {!r}'.format(req))
@@ -1,11 +1,19 @@
 from __future__ import absolute_import
+import array
+import bisect
+import errno
+import heapq
+import mmap
+import os
+import struct
 import sys
 import io
 import threading
 import time
-from collections import namedtuple
+from collections import deque, namedtuple
 
 import zlx.int
+import zlx.mth
 import zlx.record
 
 from zlx.utils import sfmt, dmsg, omsg, emsg
@@ -24,6 +32,22 @@ def bin_save (path, content):
     with open(path, 'wb') as f:
         return f.write(content)
 
+def map_file (path):
+    '''
+    maps the given file in memory read-only and returns a memoryview of it;
+    pages are loaded by the OS only when accessed;
+    on Python 2 mmap objects do not support memoryview so the mmap object
+    itself is returned
+    '''
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b'')
+        m = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    try:
+        return memoryview(m)
+    except TypeError:
+        return m
+
 def txt_load (path):
     with open(path, 'r') as f:
         return f.read()
@@ -39,18 +63,52 @@ class chunk (object):
         self.offset = offset
         self.size = size
 
+def make_u64_array (items = ()):
+    '''
+    returns a compact array of unsigned 64-bit integers (where available)
+    '''
+    try:
+        return array.array('Q', items)
+    except ValueError:
+        return array.array('L', items)
+
 class chunked_stream (io.RawIOBase):
+    '''
+    Read-only stream made of chunks (parts of other streams).
+    Chunks that follow each other in the same backing stream are merged
+    into runs; the run table is kept in compact arrays:
+        run_pos[i]      - offset in this stream where run i starts
+                          (run_pos[-1] is the size of the stream)
+        run_offset[i]   - offset of run i in its backing stream
+        run_stream[i]   - index in self.streams of the backing stream
+    '''
 
     def __init__ (self, io_chunks):
-        self.io_chunks = tuple(io_chunks)
-        self.chunk_pos = []
+        streams = []
+        stream_index = {}
+        self.run_pos = make_u64_array()
+        self.run_offset = make_u64_array()
+        self.run_stream = array.array('I')
         pos = 0
-        for c in self.io_chunks:
-            self.chunk_pos.append(pos)
+        run_end = None
+        for c in io_chunks:
+            if not c.size: continue
+            sx = stream_index.get(id(c.stream))
+            if sx is None:
+                sx = stream_index[id(c.stream)] = len(streams)
+                streams.append(c.stream)
+            if run_end != c.offset or self.run_stream[-1] != sx:
+                self.run_pos.append(pos)
+                self.run_offset.append(c.offset)
+                self.run_stream.append(sx)
             pos += c.size
+            run_end = c.offset + c.size
+        self.streams = tuple(streams)
+        self.run_count = len(self.run_pos)
         self.size = pos
-        self.chunk_pos.append(pos)
+        self.run_pos.append(pos)
         self.pos = 0
+        self.rx = 0 # index of the run used by the last read
 
     def seekable (self):
         return True
@@ -64,39 +122,47 @@ class chunked_stream (io.RawIOBase):
         self.pos = offset
         return offset
 
-    def offset_to_chunk_index (self, offset):
-        a, b = 0, len(self.io_chunks) - 1
-        while a <= b:
-            c = (a + b) // 2
-            if offset >= self.chunk_pos[c]:
-                if offset < self.chunk_pos[c + 1]:
-                    return c
-                a = c + 1
-            else:
-                b = c - 1
-        return None
+    def offset_to_run_index (self, offset):
+        r = bisect.bisect_right(self.run_pos, offset) - 1
+        if r < 0 or r >= self.run_count: return None
+        return r
 
     def readinto (self, b):
         size = len(b)
-        #print('readinto pos={} size={}'.format(self.pos, size))
+        mv = memoryview(b)
         out_ofs = 0
-        while out_ofs < size:
-            cx = self.offset_to_chunk_index(self.pos)
-            if cx is None: break
-            offset_in_chunk = self.pos - self.chunk_pos[cx]
-            cplen = min(size - out_ofs, self.io_chunks[cx].size - offset_in_chunk)
-            #print('cx={} oic={} seekpos={} cplen={}'.format(cx, self.io_chunks[cx].offset + offset_in_chunk, self.io_chunks[cx].offset + offset_in_chunk, cplen))
-            self.io_chunks[cx].stream.seek(self.io_chunks[cx].offset + offset_in_chunk)
-            #print('before data={!r}'.format(b[out_ofs:out_ofs + cplen]))
-            data = self.io_chunks[cx].stream.read(cplen)
-            n = len(data)
-            b[out_ofs:out_ofs + n] = data
-            #print('n={} data={!r}'.format(n, b[out_ofs:out_ofs + cplen]))
+        rx = self.rx
+        run_pos = self.run_pos
+        while out_ofs < size and self.pos < self.size:
+            # sequential reads continue in the run used last or the next one
+            if not (run_pos[rx] <= self.pos < run_pos[rx + 1]):
+                if rx + 1 < self.run_count and run_pos[rx + 1] <= self.pos < run_pos[rx + 2]:
+                    rx += 1
+                else:
+                    rx = self.offset_to_run_index(self.pos)
+            offset_in_run = self.pos - run_pos[rx]
+            cplen = min(size - out_ofs, run_pos[rx + 1] - self.pos)
+            n = read_at_into(self.streams[self.run_stream[rx]],
+                    self.run_offset[rx] + offset_in_run, mv[out_ofs : out_ofs + cplen])
             out_ofs += n
             self.pos += n
             if n != cplen: break
+        self.rx = rx
         return out_ofs
 
+def stream_readinto (stream, b):
+    '''
+    reads into the writable buffer b using stream.readinto() if available;
+    returns the number of bytes read
+    '''
+    readinto = getattr(stream, 'readinto', None)
+    if readinto is not None:
+        return readinto(b) or 0
+    data = stream.read(len(b))
+    if not data: return 0
+    b[0:len(data)] = data
+    return len(data)
+
 class ba_view (io.RawIOBase):
     '''
     Creates a stream backed by an existing bytearray-like object.
@@ -115,13 +181,484 @@ class ba_view (io.RawIOBase):
         self.pos = offset
         return offset
     def readinto (self, b):
-        cplen = min(len(b), len(self.ba) - self.pos)
-        if cplen <= 0: return None
-        b[0:cplen] = self.ba[self.pos : self.pos + cplen]
+        cplen = self.readinto_at(self.pos, b)
+        self.pos += cplen
+        return cplen
+    def readinto_at (self, offset, b):
+        cplen = min(len(b), len(self.ba) - offset)
+        if cplen <= 0: return 0
+        b[0:cplen] = self.ba[offset : offset + cplen]
         return cplen
     def __len__ (self):
         return len(self.ba)
 
+HAVE_PREAD = hasattr(os, 'pread')
+HAVE_PREADV = hasattr(os, 'preadv')
+seek_read_lock = threading.Lock()
+
+if sys.version_info[0] >= 3:
+    RAW_FILE_TYPES = (io.FileIO,)
+else:
+    RAW_FILE_TYPES = (io.FileIO, file)
+
+class pread_stream (io.RawIOBase):
+    '''
+    Read-only stream over a file (path, file descriptor or file object)
+    that reads with os.preadv() / os.pread() and keeps its own position.
+    It never moves the shared file position, so several pread_stream
+    objects (or threads) can read the same file at once.
+    Where positional reads are missing, it falls back to seek + read
+    under a global lock.
+    '''
+    def __init__ (self, source):
+        self.source = source # keeps a file object (and its fd) alive
+        self.own_fd = False
+        if isinstance(source, str):
+            self.fd = os.open(source, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            self.own_fd = True
+        elif isinstance(source, int):
+            self.fd = source
+        else:
+            self.fd = source.fileno()
+        self.pos = 0
+
+    def readable (self): return True
+
+    def seekable (self): return True
+
+    def fileno (self): return self.fd
+
+    def seek (self, offset, whence = SEEK_SET):
+        if whence == SEEK_SET: pass
+        elif whence == SEEK_CUR: offset += self.pos
+        elif whence == SEEK_END: offset += os.fstat(self.fd).st_size
+        else: raise ValueError('unsupported whence {}'.format(whence))
+        if offset < 0: raise ValueError('negative offset')
+        self.pos = offset
+        return offset
+
+    def readinto_at (self, offset, b):
+        '''
+        reads into the writable buffer b from the given offset;
+        returns the number of bytes read (0 at EOF)
+        '''
+        if HAVE_PREADV:
+            return os.preadv(self.fd, [b], offset)
+        if HAVE_PREAD:
+            data = os.pread(self.fd, len(b), offset)
+        else:
+            with seek_read_lock:
+                os.lseek(self.fd, offset, SEEK_SET)
+                data = os.read(self.fd, len(b))
+        b[0:len(data)] = data
+        return len(data)
+
+    def readinto (self, b):
+        n = self.readinto_at(self.pos, b)
+        self.pos += n
+        return n
+
+    def close (self):
+        if self.own_fd and not self.closed:
+            os.close(self.fd)
+        io.RawIOBase.close(self)
+
+HAVE_SEEK_HOLE = hasattr(os, 'SEEK_HOLE') and hasattr(os, 'SEEK_DATA')
+
+def find_holes (fd, end):
+    '''
+    returns the list of (offset, size) holes the file system reports (with
+    lseek SEEK_DATA / SEEK_HOLE) for the file descriptor up to end;
+    returns an empty list where probing is not supported.
+    The file position is preserved.
+    '''
+    if not HAVE_SEEK_HOLE: return []
+    holes = []
+    saved = os.lseek(fd, 0, SEEK_CUR)
+    try:
+        o = 0
+        while o < end:
+            try:
+                d = min(os.lseek(fd, o, os.SEEK_DATA), end)
+            except OSError as e:
+                if e.errno != errno.ENXIO: return []
+                d = end # no more data
+            if d > o: holes.append((o, d - o))
+            if d >= end: break
+            o = os.lseek(fd, d, os.SEEK_HOLE)
+    finally:
+        os.lseek(fd, saved, SEEK_SET)
+    return holes
+
+def file_stream_fd (stream):
+    '''
+    returns the file descriptor the stream reads its bytes straight from
+    (raw or buffered files, pread_stream) or None; other streams with a
+    fileno() (decompressors, ...) do not return the bytes of that file
+    '''
+    if isinstance(stream, pread_stream): return stream.fd
+    if isinstance(getattr(stream, 'raw', stream), RAW_FILE_TYPES):
+        return stream.fileno()
+    return None
+
+def positional_stream (stream):
+    '''
+    returns a pread_stream for raw or buffered file streams, and the
+    stream itself otherwise
+    '''
+    if hasattr(stream, 'readinto_at'): return stream
+    if file_stream_fd(stream) is None: return stream
+    return pread_stream(stream)
+
+def read_at_into (stream, offset, b):
+    '''
+    reads into b from the given offset of stream, with a positional read if
+    the stream supports it (readinto_at) or with seek + readinto otherwise
+    '''
+    readinto_at = getattr(stream, 'readinto_at', None)
+    if readinto_at is not None:
+        return readinto_at(offset, b)
+    stream.seek(offset)
+    return stream_readinto(stream, b)
+
+READ_AHEAD_SIZE = 0x10000
+
+class read_ahead_stream (io.RawIOBase):
+    '''
+    Serves small reads from large chunks read from the underlying stream.
+    Relative seeks within the buffered data do not touch the underlying
+    stream. release() seeks the underlying stream back over the data that
+    was read ahead but not consumed (if the stream is seekable).
+    '''
+    def __init__ (self, stream, chunk_size = READ_AHEAD_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buf = b''
+        self.buf_pos = 0
+        self.eof = False
+
+    def readable (self): return True
+
+    def seekable (self): return self.stream.seekable()
+
+    def fill (self, size):
+        '''
+        buffers at least size bytes unless EOF is hit; returns the number
+        of bytes available
+        '''
+        avail = len(self.buf) - self.buf_pos
+        if avail < size and not self.eof:
+            parts = [self.buf[self.buf_pos:]]
+            while avail < size:
+                data = self.stream.read(max(self.chunk_size, size - avail))
+                if not data:
+                    self.eof = True
+                    break
+                parts.append(data)
+                avail += len(data)
+            self.buf = b''.join(parts)
+            self.buf_pos = 0
+        return avail
+
+    def read (self, size = -1):
+        if size is None or size < 0:
+            data = self.buf[self.buf_pos:] + (self.stream.read() or b'')
+            self.buf = b''
+            self.buf_pos = 0
+            self.eof = True
+            return data
+        self.fill(size)
+        data = self.buf[self.buf_pos : self.buf_pos + size]
+        self.buf_pos += len(data)
+        return data
+
+    def readinto (self, b):
+        data = self.read(len(b))
+        b[0:len(data)] = data
+        return len(data)
+
+    def tell (self):
+        return self.stream.seek(0, SEEK_CUR) - (len(self.buf) - self.buf_pos)
+
+    def seek (self, offset, whence = SEEK_SET):
+        if whence == SEEK_CUR and 0 <= self.buf_pos + offset <= len(self.buf):
+            self.buf_pos += offset
+            return self.tell()
+        if whence == SEEK_CUR:
+            offset += self.tell()
+            whence = SEEK_SET
+        self.buf = b''
+        self.buf_pos = 0
+        self.eof = False
+        return self.stream.seek(offset, whence)
+
+    def release (self):
+        '''
+        gives back to the underlying stream the data not consumed
+        '''
+        unused = len(self.buf) - self.buf_pos
+        if unused and self.stream.seekable():
+            self.stream.seek(-unused, SEEK_CUR)
+        self.buf = b''
+        self.buf_pos = 0
+
+#/* rope *********************************************************************/
+class rope (object):
+    '''
+    Sequence of bytes kept as a list of immutable segments (bytes or
+    memoryview) so appending, splitting and overwriting never copy the data
+    already held; slices within a segment are memoryviews of it.
+    '''
+    __slots__ = 'segments ends'.split()
+
+    def __init__ (self, segments = ()):
+        self.segments = []
+        self.ends = [] # end offset of each segment
+        for seg in segments: self.append(seg)
+
+    def __len__ (self):
+        return self.ends[-1] if self.ends else 0
+
+    def __getitem__ (self, s):
+        o, e, step = s.indices(len(self))
+        assert step == 1, 'only contiguous slices'
+        return self.slice(o, max(e - o, 0))
+
+    def append (self, seg):
+        if not len(seg): return
+        self.ends.append(len(self) + len(seg))
+        self.segments.append(seg)
+
+    def extend (self, other):
+        n = len(self)
+        self.segments.extend(other.segments)
+        self.ends.extend(e + n for e in other.ends)
+
+    def split (self, pos):
+        '''
+        keeps the first pos bytes and returns a rope with the rest
+        '''
+        sx = bisect.bisect_right(self.ends, pos)
+        right = rope()
+        if sx == len(self.segments): return right
+        start = self.ends[sx - 1] if sx else 0
+        if start < pos:
+            seg = memoryview(self.segments[sx])
+            right.append(seg[pos - start:])
+            self.segments[sx] = seg[0 : pos - start]
+            self.ends[sx] = pos
+            sx += 1
+        for seg in self.segments[sx:]: right.append(seg)
+        del self.segments[sx:]
+        del self.ends[sx:]
+        return right
+
+    def replace (self, pos, data):
+        '''
+        overwrites the bytes from pos with data (which must not change
+        afterwards)
+        '''
+        tail = self.split(pos)
+        rest = tail.split(len(data))
+        self.append(data)
+        self.extend(rest)
+
+    def slice (self, offset, size):
+        '''
+        returns a memoryview of size bytes from offset; it refers to the
+        segment holding them or, when they span segments, to a copy
+        '''
+        sx = bisect.bisect_right(self.ends, offset)
+        if sx == len(self.segments): return memoryview(b'')
+        start = self.ends[sx - 1] if sx else 0
+        size = min(size, len(self) - offset)
+        if offset + size <= self.ends[sx]:
+            return memoryview(self.segments[sx])[offset - start : offset - start + size]
+        b = bytearray(size)
+        n = 0
+        while n < size:
+            seg = memoryview(self.segments[sx])[offset + n - start:]
+            k = min(len(seg), size - n)
+            b[n : n + k] = seg[0:k]
+            n += k
+            start = self.ends[sx]
+            sx += 1
+        return memoryview(b)
+
+    def tobytes (self):
+        # bytes(memoryview) is str() on Python 2
+        return b''.join(seg if isinstance(seg, bytes) else memoryview(seg).tobytes() for seg in self.segments)
+
+    def compact_segment (self, sx, ratio = 2):
+        '''
+        replaces segment sx with a copy if it is a slice of a buffer more
+        than ratio times larger, so that buffer can be freed; Python 2
+        memoryviews do not expose their buffer (no obj) so nothing is
+        compacted there
+        '''
+        seg = self.segments[sx]
+        base = getattr(seg, 'obj', None)
+        if base is None or isinstance(base, mmap.mmap): return # mapped pages are not held
+        if memoryview(base).nbytes > ratio * len(seg):
+            self.segments[sx] = seg.tobytes()
+
+#/* stream_cache_store *******************************************************/
+def source_identity (path):
+    '''
+    returns (absolute path, size, mtime in ns) for the given file
+    '''
+    st = os.stat(path)
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None: mtime_ns = int(st.st_mtime * 1000000000)
+    return os.path.abspath(path), st.st_size, mtime_ns
+
+class stream_cache_store (object):
+    '''
+    Persistent copy of the cached parts of a source file: the data goes to
+    a sparse file at path (at the same offsets as in the source) and the
+    list of stored ranges to the sidecar path + '.map', together with the
+    identity of the source (path, size, mtime). If the source changed or
+    the sidecar is damaged, the stored data is discarded.
+    Call flush() (or close()) to save the sidecar.
+    '''
+    MAGIC = b'zlxscm1\0'
+    header_struct = struct.Struct('<8sQQI')
+    count_struct = struct.Struct('<Q')
+
+    def __init__ (self, path, source_path):
+        self.path = path
+        self.map_path = path + '.map'
+        self.source_id = source_identity(source_path)
+        self.lock = threading.Lock()
+        self.ranges = self._load_map()
+        self.f = open(path, 'r+b' if self.ranges else 'w+b')
+        if not self.ranges: self.f.truncate(self.source_id[1])
+        self.dirty = False
+
+    def _load_map (self):
+        if not os.path.exists(self.path): return []
+        try:
+            with open(self.map_path, 'rb') as f:
+                data = f.read()
+            ranges = self._parse_map(data)
+        except (IOError, OSError, struct.error, ValueError) as e:
+            # UnicodeDecodeError is a ValueError
+            dmsg('bad store map {!r}: {}', self.map_path, e)
+            return []
+        if ranges is None:
+            dmsg('stale store {!r}', self.path)
+            return []
+        return ranges
+
+    def _parse_map (self, data):
+        '''
+        returns the stored ranges from the sidecar data or None if they
+        belong to another source; raises on damaged data
+        '''
+        hs = self.header_struct
+        magic, size, mtime_ns, path_len = hs.unpack_from(data)
+        o = hs.size
+        path = data[o : o + path_len].decode('utf-8')
+        o += path_len
+        if magic != self.MAGIC or (path, size, mtime_ns) != self.source_id: return None
+        if os.path.getsize(self.path) != size: raise ValueError('store size mismatch')
+        count, = self.count_struct.unpack_from(data, o)
+        o += self.count_struct.size
+        a = struct.unpack_from(sfmt('<{}Q', count * 2), data, o)
+        ranges = [(a[i], a[i + 1]) for i in range(0, len(a), 2)]
+        end = 0
+        for ro, rn in ranges:
+            if ro < end or rn == 0 or ro + rn > size: raise ValueError('bad range')
+            end = ro + rn
+        return ranges
+
+    def split (self, o, e):
+        '''
+        yields (offset, end, stored) parts that cover [o, e)
+        '''
+        with self.lock:
+            ranges = self.ranges
+        rx = bisect.bisect_right(ranges, (o, )) - 1
+        if rx < 0: rx = 0
+        while o < e:
+            while rx < len(ranges) and ranges[rx][0] + ranges[rx][1] <= o: rx += 1
+            if rx == len(ranges) or ranges[rx][0] >= e:
+                yield o, e, False
+                return
+            ro, rn = ranges[rx]
+            if o < ro:
+                yield o, ro, False
+                o = ro
+            n = min(e, ro + rn)
+            yield o, n, True
+            o = n
+
+    def read (self, offset, size):
+        with self.lock:
+            self.f.seek(offset)
+            return self.f.read(size)
+
+    def write (self, offset, data):
+        with self.lock:
+            self.f.seek(offset)
+            self.f.write(data)
+            self.ranges = merge_ranges(self.ranges + [(offset, len(data))])
+            self.dirty = True
+
+    def flush (self):
+        with self.lock:
+            if not self.dirty: return
+            self.f.flush()
+            path = self.source_id[0].encode('utf-8')
+            flat = [x for r in self.ranges for x in r]
+            data = (self.header_struct.pack(self.MAGIC, self.source_id[1], self.source_id[2], len(path))
+                + path + self.count_struct.pack(len(self.ranges))
+                + struct.pack(sfmt('<{}Q', len(flat)), *flat))
+            tmp_path = self.map_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            if hasattr(os, 'replace'):
+                os.replace(tmp_path, self.map_path)
+            else:
+                if os.path.exists(self.map_path): os.remove(self.map_path)
+                os.rename(tmp_path, self.map_path)
+            self.dirty = False
+
+    def close (self):
+        self.flush()
+        self.f.close()
+
+    def __enter__ (self): return self
+
+    def __exit__ (self, *exc): self.close()
+
+#/* latency_histogram ********************************************************/
+clock = getattr(time, 'perf_counter', time.time)
+
+class latency_histogram (object):
+    '''
+    Counts durations in power of 2 buckets of microseconds: bucket i holds
+    the durations below 2**i us (and at least 2**(i-1) us).
+    '''
+    def __init__ (self):
+        self.buckets = []
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add (self, seconds):
+        us = int(seconds * 1000000)
+        bx = us.bit_length() if us > 0 else 0
+        if bx >= len(self.buckets): self.buckets.extend([0] * (bx + 1 - len(self.buckets)))
+        self.buckets[bx] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict (self):
+        return dict(count = self.count, total_sec = self.total, max_sec = self.max,
+                buckets_us = [(1 << bx, n) for bx, n in enumerate(self.buckets) if n])
+
 #/* stream_cache *************************************************************/
 SCK_UNCACHED = 0
 SCK_CACHED = 1
@@ -140,7 +677,7 @@ class cached_data_block (zlx.record.Record):
     kind = SCK_CACHED
     _field_repr = {}
     def get_size (self): return len(self.data)
-    def desc (x): return sfmt('cached(0x{:X},0x{:X},{!r})', x.offset, len(x.data), bytes(x.data[0:4]))
+    def desc (x): return sfmt('cached(0x{:X},0x{:X},{!r})', x.offset, len(x.data), x.data[0:4].tobytes())
     def __repr__ (self): return self.desc()
 
 class hole_block (zlx.record.Record):
@@ -155,16 +692,212 @@ class hole_block (zlx.record.Record):
             return sfmt('end(0x{:X})', x.offset)
     def __repr__ (self): return self.desc()
 
+#/* read_ahead_policy ********************************************************/
+class read_ahead_policy (object):
+    '''
+    Detects sequential and strided access patterns. While they last, the
+    read-ahead window doubles (from min_window up to max_window); any other
+    access resets it.
+    '''
+
+    def __init__ (self, min_window, max_window):
+        self.min_window = min_window
+        self.max_window = max_window
+        self.window = 0
+        self.stride = None
+        self.last_offset = None
+        self.last_end = None
+
+    def grow_ (self):
+        self.window = min(max(self.window * 2, self.min_window), self.max_window)
+
+    def update (self, offset, size):
+        '''
+        records an access and returns the list of (offset, size) ranges
+        worth prefetching
+        '''
+        prefetch = []
+        end = offset + size
+        if self.last_offset is not None and self.last_offset <= offset <= self.last_end:
+            self.grow_()
+            prefetch.append((end, self.window))
+            self.stride = None
+        else:
+            stride = None if self.last_offset is None else offset - self.last_offset
+            if stride and stride == self.stride:
+                self.grow_()
+                if abs(stride) <= self.window:
+                    # strides are close: read the next window in one go
+                    if stride > 0: prefetch.append((end, self.window))
+                    else: prefetch.append((max(0, offset - self.window), min(offset, self.window)))
+                elif offset + stride >= 0:
+                    prefetch.append((offset + stride, size))
+            else:
+                self.window = 0
+            self.stride = stride
+        self.last_offset = offset
+        self.last_end = end
+        return prefetch
+
+def merge_ranges (ranges):
+    '''
+    sorts (offset, size) ranges and merges the overlapping / adjacent ones
+    '''
+    merged = []
+    for o, n in sorted(ranges):
+        if merged and o <= merged[-1][0] + merged[-1][1]:
+            mo, mn = merged[-1]
+            merged[-1] = (mo, max(mn, o + n - mo))
+        elif n > 0:
+            merged.append((o, n))
+    return merged
+
+#/* page_lru *****************************************************************/
+class page_lru (object):
+    '''
+    Least recently used order of pages where using a range of pages costs
+    O(log n) whatever its length. Uses are recorded as page ranges tagged
+    with an increasing generation; the heap keeps each page with the
+    generation it was last ranked at and pop() re-ranks stale pages lazily.
+    '''
+    def __init__ (self):
+        self.gen = 0
+        self.heap = [] # (generation, page), generations may be stale
+        self.page_gen = {} # page -> its generation in heap
+        self.starts = [] # disjoint used page ranges [start, end] ...
+        self.ends = []
+        self.gens = [] # ... and the generation of their last use
+
+    def __len__ (self):
+        return len(self.page_gen)
+
+    def add (self, first, last):
+        '''
+        starts tracking pages first..last (inclusive) as most recently used
+        '''
+        self.use(first, last)
+        for p in range(first, last + 1):
+            if p not in self.page_gen:
+                self.page_gen[p] = self.gen
+                heapq.heappush(self.heap, (self.gen, p))
+
+    def use (self, first, last):
+        '''
+        marks pages first..last (inclusive) as most recently used
+        '''
+        self.gen += 1
+        i = bisect.bisect_left(self.ends, first)
+        j = bisect.bisect_right(self.starts, last)
+        starts = [first]
+        ends = [last]
+        gens = [self.gen]
+        if i < j and self.starts[i] < first:
+            starts.insert(0, self.starts[i])
+            ends.insert(0, first - 1)
+            gens.insert(0, self.gens[i])
+        if i < j and self.ends[j - 1] > last:
+            starts.append(last + 1)
+            ends.append(self.ends[j - 1])
+            gens.append(self.gens[j - 1])
+        self.starts[i:j] = starts
+        self.ends[i:j] = ends
+        self.gens[i:j] = gens
+        if len(self.starts) > 2 * len(self.page_gen) + 64: self._rerank()
+
+    def _last_use (self, p):
+        i = bisect.bisect_right(self.starts, p) - 1
+        return self.gens[i] if i >= 0 and self.ends[i] >= p else 0
+
+    def _rerank (self):
+        for p, g in self.page_gen.items():
+            self.page_gen[p] = max(g, self._last_use(p))
+        self.heap = [(g, p) for p, g in self.page_gen.items()]
+        heapq.heapify(self.heap)
+        del self.starts[:], self.ends[:], self.gens[:]
+
+    def pop (self):
+        '''
+        stops tracking the least recently used page and returns it
+        (None if no pages are tracked)
+        '''
+        while self.heap:
+            g, p = heapq.heappop(self.heap)
+            u = self._last_use(p)
+            if u > g:
+                self.page_gen[p] = u
+                heapq.heappush(self.heap, (u, p))
+                continue
+            del self.page_gen[p]
+            return p
+        return None
+
 #/* stream_cache *************************************************************/
 class stream_cache (object):
+    '''
+    Keeps track of which parts of a stream are cached (in memory), not
+    cached yet or holes (no data, including EOF).
+    self.blocks lists these parts in order; self.offsets holds their start
+    offsets so blocks are located with a binary search.
+    With max_cached_bytes set (seekable streams only), the least recently
+    used pages (of align bytes) are evicted back to uncached blocks once the
+    cached data exceeds the budget; cached_bytes, evicted_bytes and
+    reloaded_bytes count what happens.
+    With max_read_ahead set, load() also loads ahead of sequential or strided
+    accesses (see read_ahead_policy).
+    With positional = True, raw or buffered file streams are read
+    with positional reads (see pread_stream) without holding the cache lock,
+    so several threads can load different ranges at once.
+    With io_workers (a zlx.mth.worker_manager) and a stream that supports
+    positional reads, loads larger than io_chunk_size are split in aligned
+    chunks read concurrently by the workers (do not load from jobs running
+    on the same workers).
+    With probe_holes = True, raw or buffered file streams are probed
+    for holes (see find_holes) which are recorded as hole blocks: they read
+    as zeros and never get loaded; hole_bytes counts them.
+    stats() returns counters (get_part hits / misses / holes, loads, loaded
+    bytes, fragments, peak cached bytes, ...) and the load latencies.
+    With trace (a text stream), get_part() and load() calls are written to
+    it as "part:<offset>:<size>" / "load:<offset>:<size>" lines, which
+    test-stream-cache can replay.
+    With a store (see stream_cache_store; seekable streams only), loaded
+    data is also written to the store, ranges found in the store are read
+    from it instead of the stream and, on creation, the stored ranges are
+    cached again (up to max_cached_bytes) as slices of the store mapped in
+    memory, so the OS reads them only when accessed (on Python 2 they are
+    read from the store when loaded).
+    '''
 
-    def __init__ (self, stream, align = 4096, assume_size = None):
+    def __init__ (self, stream, align = 4096, assume_size = None, positional = False,
+            max_cached_bytes = None, max_read_ahead = 0, store = None,
+            probe_holes = False, io_workers = None, io_chunk_size = 0x100000,
+            trace = None):
 
         object.__init__(self)
+        if positional: stream = positional_stream(stream)
         self.stream = stream
+        self.lock = threading.RLock()
 
         self.seekable = False
+        self.pos = 0 # where reads from an unseekable stream continue
         self.blocks = []
+        self.offsets = []
+
+        self.cached_bytes = 0
+        self.peak_cached_bytes = 0
+        self.hole_bytes = 0
+        self.get_hits = 0
+        self.get_misses = 0
+        self.get_holes = 0
+        self.load_count = 0
+        self.loaded_bytes = 0 # from the stream
+        self.store_loaded_bytes = 0 # from the store
+        self.load_latency = latency_histogram()
+        self.trace = trace
+        self.evicted_bytes = 0
+        self.reloaded_bytes = 0
+        self.max_cached_bytes = max_cached_bytes
+        self.lru = page_lru()
+        self.evicted_pages = set()
 
         if assume_size is not None:
             self.seekable = stream.seekable()
@@ -179,13 +912,39 @@ class stream_cache (object):
                 pass
         if self.seekable:
             if end > 0:
-                self.blocks.append(uncached_data_block(0, end))
-            self.blocks.append(hole_block(end, 0))
+                self._insert_block(0, uncached_data_block(0, end))
+            self._insert_block(len(self.blocks), hole_block(end, 0))
             assert zlx.int.pow2_check(align), "alignment must be a power of 2"
             self.align = align # alignment for offsets / sizes when doing I/O
         else:
-            self.blocks.append(hole_block(0, 0))
+            self._insert_block(0, hole_block(0, 0))
             self.align = 1
+            self.max_cached_bytes = None # cannot reload what gets evicted
+        self.read_ahead = read_ahead_policy(self.align, max_read_ahead) if max_read_ahead and self.seekable else None
+        self.io_workers = io_workers
+        self.io_chunk_size = zlx.int.pow2_round_up(io_chunk_size, self.align)
+        if probe_holes and self.seekable and end > 0: self._probe_holes(end)
+        self.store = store if self.seekable else None
+        if self.store is not None and self.store.ranges:
+            m = map_file(self.store.path)
+            if isinstance(m, memoryview):
+                for o, n in self.store.ranges:
+                    if self.max_cached_bytes is not None and self.cached_bytes + n > self.max_cached_bytes: break
+                    self._update_data(o, m[o : o + n])
+
+    def _probe_holes (self, end):
+        fd = file_stream_fd(self.stream)
+        if fd is None: return
+        blocks = []
+        o = 0
+        for ho, hn in find_holes(fd, end):
+            if o < ho: blocks.append(uncached_data_block(o, ho - o))
+            blocks.append(hole_block(ho, hn))
+            o = ho + hn
+            self.hole_bytes += hn
+        if not blocks: return
+        if o < end: blocks.append(uncached_data_block(o, end - o))
+        self._replace_blocks(0, 1, blocks)
 
     def __repr__ (self):
         return sfmt('stream_cache(stream={!r}, seekable={!r}, blocks=[\n    {}])', self.stream, self.seekable, '\n    '.join([x.desc() for x in self.blocks]))
@@ -204,12 +963,29 @@ class stream_cache (object):
         return a
 
     def locate_block (self, offset):
-        for i in range(len(self.blocks)):
-            b = self.blocks[i]
-            if offset >= b.offset and offset - b.offset < b.get_size():
-                return i, b
+        bx = bisect.bisect_right(self.offsets, offset) - 1
+        if bx >= 0:
+            b = self.blocks[bx]
+            if offset - b.offset < b.get_size():
+                return bx, b
         return len(self.blocks) - 1, self.blocks[-1]
 
+    def _insert_block (self, bx, blk):
+        self.blocks.insert(bx, blk)
+        self.offsets.insert(bx, blk.offset)
+
+    def _delete_block (self, bx):
+        del self.blocks[bx]
+        del self.offsets[bx]
+
+    def _replace_blocks (self, bx, count, new_blocks):
+        self.blocks[bx : bx + count] = new_blocks
+        self.offsets[bx : bx + count] = [b.offset for b in new_blocks]
+
+    def _move_block (self, bx, offset):
+        self.blocks[bx].offset = offset
+        self.offsets[bx] = offset
+
     def get_known_end_offset (self):
         return self.blocks[len(self.blocks) - 1].offset
 
@@ -224,6 +1000,49 @@ class stream_cache (object):
             raise ValueError('negative size: {}'.format(size))
         if offset < 0:
             return hole_block(offset, min(size, -offset))
+        with self.lock:
+            if self.trace is not None: self.trace.write(sfmt('part:{}:{}\n', offset, size))
+            b = self._get_part(offset, size)
+            if b.kind == SCK_CACHED: self.get_hits += 1
+            elif b.kind == SCK_UNCACHED: self.get_misses += 1
+            else: self.get_holes += 1
+            return b
+
+    def _get_parts (self, offset, size):
+        '''
+        like get() but not counted as an access (in stats or LRU order)
+        '''
+        a = []
+        with self.lock:
+            while size:
+                blk = self._get_part(offset, size, use = False)
+                a.append(blk)
+                offset += blk.get_size()
+                size -= blk.get_size() or size
+        return a
+
+    def stats (self):
+        '''
+        returns a dict with the counters and the load latency histogram
+        '''
+        with self.lock:
+            return dict(
+                    get_hits = self.get_hits,
+                    get_misses = self.get_misses,
+                    get_holes = self.get_holes,
+                    load_count = self.load_count,
+                    loaded_bytes = self.loaded_bytes,
+                    store_loaded_bytes = self.store_loaded_bytes,
+                    cached_bytes = self.cached_bytes,
+                    peak_cached_bytes = self.peak_cached_bytes,
+                    evicted_bytes = self.evicted_bytes,
+                    reloaded_bytes = self.reloaded_bytes,
+                    hole_bytes = self.hole_bytes,
+                    fragments = sum(1 for b in self.blocks if b.kind == SCK_CACHED),
+                    blocks = len(self.blocks),
+                    load_latency = self.load_latency.to_dict())
+
+    def _get_part (self, offset, size, use = True):
         bx, b = self.locate_block(offset)
         dmsg('offset 0x{:X} -> bx={} b={!r}', offset, bx, b)
         if b.kind == SCK_UNCACHED:
@@ -234,7 +1053,8 @@ class stream_cache (object):
             assert b.offset <= offset and offset - b.offset < b_size
             n = min(size, b.offset + b_size - offset)
             o = offset - b.offset
-            return cached_data_block(offset, b.data[o : o + n])
+            if use and self.max_cached_bytes is not None: self.lru.use(*self._page_span(offset, n))
+            return cached_data_block(offset, b.data.slice(o, n))
         elif b.kind == SCK_HOLE:
             assert b.offset <= offset
             assert b.size == 0 or offset - b.offset < b.size, repr((self, b, offset))
@@ -254,76 +1074,239 @@ class stream_cache (object):
                 raise RuntimeError("unseekable cannot change pos from {} to {}".format(self.pos, offset))
 
     def _load (self, o, e):
-        self._seek(o)
+        if self.store is not None:
+            for so, se, stored in self.store.split(o, e):
+                if not stored:
+                    self._load_stream(so, se)
+                    continue
+                data = self.store.read(so, se - so)
+                with self.lock:
+                    self._update_data(so, data)
+                    self.store_loaded_bytes += len(data)
+        else:
+            self._load_stream(o, e)
+
+    def _load_stream (self, o, e):
+        if self.seekable and hasattr(self.stream, 'readinto_at'):
+            if self.io_workers is not None and e - o > self.io_chunk_size:
+                return self._load_parallel(o, e)
+            return self._load_positional(o, e)
+        with self.lock:
+            self._seek(o)
+            while o < e:
+                data = self.stream.read(e - o)
+                dmsg('got 0x{} bytes', len(data) if data else 0)
+                if not data:
+                    self._update_no_data(o)
+                    break
+                self._update_data(o, data)
+                self.loaded_bytes += len(data)
+                if self.store is not None: self.store.write(o, data)
+                o += len(data)
+                self.pos = o
+
+    def _load_positional (self, o, e):
+        '''
+        loads without holding the lock while reading
+        '''
         while o < e:
-            data = self.stream.read(e - o)
-            dmsg('got 0x{} bytes', len(data) if data else 0)
-            if not data:
-                self._update_no_data(o)
-                break
-            self._update_data(o, data)
-            o += len(data)
+            b = bytearray(e - o)
+            n = self.stream.readinto_at(o, b)
+            dmsg('got 0x{} bytes', n)
+            with self.lock:
+                if not n:
+                    self._update_no_data(o)
+                    break
+                self._update_data(o, memoryview(b)[0:n])
+                self.loaded_bytes += n
+            if self.store is not None: self.store.write(o, memoryview(b)[0:n])
+            o += n
 
-    def load (self, offset, size):
-        o = zlx.int.pow2_round_down(offset, self.align)
-        e = zlx.int.pow2_round_up(offset + size, self.align)
+    def _load_parallel (self, o, e):
+        '''
+        reads aligned chunks of [o, e) on self.io_workers then updates the
+        blocks in offset order
+        '''
+        jobs = []
+        co = o
+        while co < e:
+            ce = min(zlx.int.pow2_round_down(co + self.io_chunk_size, self.align), e)
+            b = bytearray(ce - co)
+            job = self.io_workers.queue(lambda co = co, b = b: self.stream.readinto_at(co, b))
+            jobs.append((co, ce, b, job))
+            co = ce
+        error = None
+        for co, ce, b, job in jobs:
+            if job.wait() != zlx.mth.COMPLETE:
+                error = error or getattr(job, 'error', None) or RuntimeError('read job cancelled')
+        if error is not None: raise error
+        for co, ce, b, job in jobs:
+            n = job.result
+            if n:
+                with self.lock:
+                    self._update_data(co, memoryview(b)[0:n])
+                    self.loaded_bytes += n
+                if self.store is not None: self.store.write(co, memoryview(b)[0:n])
+            if co + n < ce:
+                # short read: finish (or find the end) the sequential way
+                self._load_positional(co + n, ce)
+                if self.get_known_end_offset() <= ce: break
+
+    def _timed_load (self, o, e):
+        t = clock()
         self._load(o, e)
-        dmsg('load o={:X} e={:X} => {!r}', o, e, self)
+        t = clock() - t
+        with self.lock:
+            self.load_count += 1
+            self.load_latency.add(t)
+
+    def load (self, offset, size):
+        if self.trace is not None:
+            with self.lock:
+                self.trace.write(sfmt('load:{}:{}\n', offset, size))
+        if not self.seekable:
+            o = zlx.int.pow2_round_down(offset, self.align)
+            e = zlx.int.pow2_round_up(offset + size, self.align)
+            self._timed_load(o, e)
+            return
+        ranges = [(offset, size)]
+        if self.read_ahead is not None:
+            with self.lock:
+                ranges.extend(self.read_ahead.update(offset, size))
+        for offset, size in merge_ranges(ranges):
+            o = zlx.int.pow2_round_down(offset, self.align)
+            e = zlx.int.pow2_round_up(offset + size, self.align)
+            for blk in self._get_parts(o, e - o):
+                if blk.kind == SCK_UNCACHED:
+                    self._timed_load(blk.offset, blk.offset + blk.size)
+            dmsg('load o={:X} e={:X} => {!r}', o, e, self)
 
     def _merge_left (self, bx):
         if bx == 0 or bx >= len(self.blocks): return
         l = self.blocks[bx - 1]
         r = self.blocks[bx]
         if l.kind != r.kind: return
+        if l.kind == SCK_HOLE and (l.size == 0) != (r.size == 0): return
         if l.offset + l.get_size() == r.offset:
             if l.kind == SCK_CACHED:
-                l.data[len(l.data):] = r.data
+                l.data.extend(r.data)
             elif l.kind == SCK_UNCACHED:
                 l.size += r.size
             elif l.kind == SCK_HOLE:
                 l.size += r.size
-                if r.size == 0: l.size = 0 # hole before eof becomes eof
-            del self.blocks[bx]
+            self._delete_block(bx)
 
     def _merge_around (self, bx, count = 1):
-        self._merge_left(bx)
         self._merge_left(bx + count)
+        self._merge_left(bx)
+
+    def _page_range (self, offset, size):
+        return range(offset // self.align, (offset + size + self.align - 1) // self.align)
+
+    def _page_span (self, offset, size):
+        '''
+        returns the first and last page of a non-empty range
+        '''
+        return offset // self.align, (offset + size - 1) // self.align
+
+    def _add_cached (self, offset, size):
+        '''
+        accounts for size bytes getting cached at offset
+        '''
+        self.cached_bytes += size
+        self.peak_cached_bytes = max(self.peak_cached_bytes, self.cached_bytes)
+        if self.max_cached_bytes is None or not size: return
+        self.lru.add(*self._page_span(offset, size))
+        if not self.evicted_pages: return
+        for p in self._page_range(offset, size):
+            if p in self.evicted_pages:
+                self.evicted_pages.discard(p)
+                self.reloaded_bytes += min(offset + size, (p + 1) * self.align) - max(offset, p * self.align)
+
+    def _enforce_budget (self):
+        while self.cached_bytes > self.max_cached_bytes and len(self.lru):
+            p = self.lru.pop()
+            n = self._uncache(p * self.align, (p + 1) * self.align)
+            if n:
+                self.evicted_bytes += n
+                self.evicted_pages.add(p)
+
+    def _uncache (self, o, e):
+        '''
+        turns cached data in [o, e) back into uncached blocks;
+        returns the number of bytes dropped
+        '''
+        dropped = 0
+        while o < e:
+            bx, b = self.locate_block(o)
+            b_end = b.offset + b.get_size()
+            if b.kind != SCK_CACHED:
+                if b_end <= o: break
+                o = b_end
+                continue
+            if b.offset < o:
+                bx, b = self._split_block(bx, o)
+            if e < b_end:
+                self._split_block(bx, e)
+            n = b.get_size()
+            # the cached data left around is sliced from the same read
+            # buffers; copy it so the budget bounds the memory really held
+            if bx > 0 and self.blocks[bx - 1].kind == SCK_CACHED:
+                self.blocks[bx - 1].data.compact_segment(-1)
+            if bx + 1 < len(self.blocks) and self.blocks[bx + 1].kind == SCK_CACHED:
+                self.blocks[bx + 1].data.compact_segment(0)
+            self._replace_blocks(bx, 1, [uncached_data_block(o, n)])
+            self._merge_around(bx)
+            self.cached_bytes -= n
+            dropped += n
+            o += n
+        return dropped
 
     def _update_data (self, offset, data):
+        '''
+        caches data (which must not change afterwards) at offset
+        '''
         dmsg('updating o=0x{:X} len=0x{:X}', offset, len(data))
+        data = memoryview(data) # slices below refer to data, no copies
         while data:
             bx, b = self.locate_block(offset)
             dmsg('ofs=0x{:X} len=0x{:X}. got block: {}', offset, len(data), b.desc())
-            if b.kind == SCK_HOLE:
+            if b.kind == SCK_HOLE and b.size == 0:
+                # past the known end: the stream grew
                 if offset > b.offset:
-                    self.blocks.insert(bx, uncached_data_block(b.offset, offset - b.offset) )
+                    self._insert_block(bx, uncached_data_block(b.offset, offset - b.offset) )
                     bx += 1
-                self.blocks.insert(bx, cached_data_block(offset, bytearray(data)))
+                self._insert_block(bx, cached_data_block(offset, rope((data, ))))
+                self._move_block(bx + 1, offset + len(data))
                 self._merge_left(bx)
-                b.offset = offset + len(data)
-                return
-            elif b.kind == SCK_UNCACHED:
+                self._add_cached(offset, len(data))
+                break
+            elif b.kind in (SCK_UNCACHED, SCK_HOLE):
+                # a (sized) hole getting data was filled in after probing
                 new_blocks = []
                 b_end = b.offset + b.size
                 if b.offset < offset:
-                    new_blocks.append(uncached_data_block(b.offset, offset - b.offset))
+                    new_blocks.append(b.__class__(b.offset, offset - b.offset))
                 nb_len = min(b_end - offset, len(data))
-                new_blocks.append(cached_data_block(offset, bytearray(data[0: nb_len])))
+                new_blocks.append(cached_data_block(offset, rope((data[0 : nb_len], ))))
                 data_end = offset + len(data)
                 if data_end < b_end:
-                    new_blocks.append(uncached_data_block(data_end, b_end - data_end))
-                self.blocks[bx : bx + 1] = new_blocks
+                    new_blocks.append(b.__class__(data_end, b_end - data_end))
+                self._replace_blocks(bx, 1, new_blocks)
                 self._merge_around(bx, len(new_blocks))
+                self._add_cached(offset, nb_len)
+                if b.kind == SCK_HOLE: self.hole_bytes -= nb_len
                 offset += nb_len
                 data = data[nb_len:]
             elif b.kind == SCK_CACHED:
                 b_end = b.offset + len(b.data)
                 update_len = min(b_end - offset, len(data))
-                b.data[offset - b.offset : offset - b.offset + update_len] = data[0 : update_len]
+                b.data.replace(offset - b.offset, data[0 : update_len])
                 offset += update_len
                 data = data[update_len:]
             else:
                 raise sfmt("huh? {!r}", b)
+        if self.max_cached_bytes is not None: self._enforce_budget()
 
     def _split_block (self, bx, offset):
         '''
@@ -336,34 +1319,108 @@ class stream_cache (object):
         assert blk.offset + blk.get_size() > offset
         if blk.offset == offset: return bx, blk
         if blk.kind == SCK_CACHED:
-            nblk = cached_data_block(offset, data = bytearray(blk.data[offset - blk.offset:]))
-            blk.data[offset - blk.offset:] = b''
+            nblk = cached_data_block(offset, data = blk.data.split(offset - blk.offset))
         else:
             nblk = blk.__class__(offset = offset, size = blk.offset + blk.size - offset)
-        self.blocks.insert(bx + 1, nblk)
+            blk.size = offset - blk.offset
+        self._insert_block(bx + 1, nblk)
         return bx + 1, nblk
 
     def _discard_contiguous_data_blocks (self, bx):
         '''
-        deletes all blocks from given index as long as they refer to data
-        (cached/uncached) and updates the next non-data block (fix offset/size).
+        deletes all blocks from given index up to the end marker (the stream
+        ends earlier than known) and moves the end marker to their offset.
         '''
         offset = self.blocks[bx].offset
-        while self.blocks[bx].kind in (SCK_CACHED, SCK_UNCACHED):
-            del self.blocks[bx]
-        assert self.blocks[bx].kind in (SCK_HOLE, )
-        if self.blocks[bx].kind == SCK_HOLE:
-            self.blocks[bx].size += offset - self.blocks[bx].offset
-        self.blocks[bx].offset = offset
+        while self.blocks[bx].kind != SCK_HOLE or self.blocks[bx].size:
+            if self.blocks[bx].kind == SCK_CACHED:
+                self.cached_bytes -= self.blocks[bx].get_size()
+            elif self.blocks[bx].kind == SCK_HOLE:
+                self.hole_bytes -= self.blocks[bx].size
+            self._delete_block(bx)
+        self._move_block(bx, offset)
         self._merge_left(bx)
 
     def _update_no_data (self, offset):
         bx, blk = self.locate_block(offset)
         dmsg('no data at 0x{:X} => got block {!r}', offset, blk)
-        if blk.kind in (SCK_CACHED, SCK_UNCACHED):
+        if blk.kind != SCK_HOLE or blk.size:
             bx, blk = self._split_block(bx, offset)
             self._discard_contiguous_data_blocks(bx)
-        pass
+
+#/* cached_stream ************************************************************/
+class cached_stream (io.RawIOBase):
+    '''
+    Read-only stream over a stream_cache (or stream_cache_proxy).
+    Reads are served from cached blocks; missing ranges are loaded through
+    the cache on demand and holes read as zeros, so any parser working
+    on streams can sit on top of the cache.
+    '''
+    def __init__ (self, cache):
+        self.cache = cache
+        self.source = getattr(cache, 'source', cache) # the stream_cache behind a proxy
+        self.pos = 0
+
+    def readable (self): return True
+
+    def seekable (self): return True
+
+    def seek (self, offset, whence = SEEK_SET):
+        if whence == SEEK_SET: pass
+        elif whence == SEEK_CUR: offset += self.pos
+        elif whence == SEEK_END: offset += self.cache.get_known_end_offset()
+        else: raise ValueError('unsupported whence {}'.format(whence))
+        if offset < 0: raise ValueError('negative offset')
+        self.pos = offset
+        return offset
+
+    def tell (self): return self.pos
+
+    def load_ (self, offset, size):
+        budget = self.source.max_cached_bytes
+        if budget is not None:
+            # loading more than the budget would evict the start of the range
+            size = min(size, max(budget - self.source.align, 1))
+        self.cache.load(offset, size)
+
+    def readinto_at (self, offset, b):
+        '''
+        reads into b from the given offset; returns the number of bytes read
+        (0 at EOF)
+        '''
+        mv = memoryview(b).cast('B') if hasattr(memoryview, 'cast') else memoryview(b)
+        n = 0
+        loaded = None
+        while n < len(mv):
+            blk = self.source.get_part(offset + n, len(mv) - n)
+            if blk.kind == SCK_CACHED:
+                size = len(blk.data)
+                mv[n : n + size] = blk.data
+            elif blk.kind == SCK_HOLE:
+                size = blk.size
+                if not size:
+                    # unseekable streams only learn where they end by reading
+                    if self.source.seekable or loaded == offset + n: break
+                    loaded = offset + n
+                    self.load_(offset + n, len(mv) - n)
+                    continue
+                mv[n : n + size] = bytearray(size)
+            elif blk.kind == SCK_UNCACHED:
+                if loaded == blk.offset:
+                    raise RuntimeError(sfmt('cannot keep 0x{:X} cached; max_cached_bytes too small?', blk.offset))
+                loaded = blk.offset
+                self.load_(blk.offset, blk.size)
+                continue
+            else:
+                raise RuntimeError(sfmt('unexpected block {!r}', blk))
+            n += size
+            loaded = None
+        return n
+
+    def readinto (self, b):
+        n = self.readinto_at(self.pos, b)
+        self.pos += n
+        return n
 
 stream_cache_load_request = namedtuple('stream_cache_load_request', 'offset size'.split())
 
@@ -374,7 +1431,7 @@ class stream_cache_server (object):
         object.__init__(self)
         self.free_worker_count = 0
         self.max_worker_count = max_worker_count
-        self.stream_queue = []
+        self.stream_queue = deque()
         self.lock = threading.Lock()
         self.cond = threading.Condition(self.lock)
         self.up = True
@@ -388,15 +1445,17 @@ class stream_cache_server (object):
         self.workers.append(th)
         th.start()
 
-    def wrap (self, stream, delay = 0):
+    def wrap (self, stream, delay = 0, max_read_ahead = 0):
         '''
         Returns a proxy stream that responds to get() by sending to a worked thread
         the request to load the missing parts from the cache and returns immediately
-        the current cache
+        the current cache.
+        With max_read_ahead set, sequential / strided get() calls also queue
+        prefetches of the data that is likely to be requested next.
         '''
         if not isinstance(stream, stream_cache):
             stream = stream_cache(stream)
-        return stream_cache_proxy(stream, self, delay = delay)
+        return stream_cache_proxy(stream, self, delay = delay, max_read_ahead = max_read_ahead)
 
     def queue_stream_ (self, scp):
         '''
@@ -424,12 +1483,12 @@ class stream_cache_server (object):
                 if not self.up:
                     dmsg('exiting worker...')
                     return
-                scp = self.stream_queue.pop(0)
+                scp = self.stream_queue.popleft()
                 self.free_worker_count -= 1
             while scp:
                 scp.work_()
                 with self.lock:
-                    if not scp.load_queue:
+                    if not scp.load_queue or not self.up:
                         scp.queued = False
                         scp = None
 
@@ -439,19 +1498,94 @@ class stream_cache_server (object):
             self.cond.notify_all()
         for worker in self.workers:
             worker.join()
+        # streams still queued will not be served: fail their waiters
+        while self.stream_queue:
+            self.stream_queue.popleft().notify_waiters_(stream_cache_server_down())
+
+class stream_cache_server_down (RuntimeError):
+    def __init__ (self):
+        RuntimeError.__init__(self, 'stream_cache_server shut down')
+
+def set_future_result (fut, result):
+    if not fut.done(): fut.set_result(result)
+
+def set_future_exception (fut, exc):
+    if not fut.done(): fut.set_exception(exc)
 
 #/* stream_cache_proxy *******************************************************/
 class stream_cache_proxy (stream_cache):
 
-    def __init__ (self, source, server, delay = 0):
+    def __init__ (self, source, server, delay = 0, max_read_ahead = 0):
         object.__init__(self)
         self.source = source
         self.server = server
         self.queued = False
         self.lock = threading.Lock()
-        self.load_queue = []
+        self.load_queue = [] # sorted, disjoint stream_cache_load_request items
+        self.queued_bytes = 0 # bytes requested through queue_load_()
+        self.merged_bytes = 0 # ... of which already pending
         self.delay = delay
         self.updated = False
+        self.waiters = [] # (offset, size, loop, future) for aget()
+        self.read_ahead = read_ahead_policy(source.align, max_read_ahead) if max_read_ahead and source.seekable else None
+
+    def get (self, offset, size):
+        a = stream_cache.get(self, offset, size)
+        if self.read_ahead is not None:
+            with self.lock:
+                prefetch = self.read_ahead.update(offset, size)
+            for o, n in prefetch:
+                for b in self.source._get_parts(o, n):
+                    if b.kind == SCK_UNCACHED: self.queue_load_(b.offset, b.size)
+        return a
+
+    def aget (self, offset, size, loop = None):
+        '''
+        returns an asyncio future resolved with get(offset, size) once the
+        whole range is cached (or known to be a hole); the server worker
+        threads complete it through loop.call_soon_threadsafe()
+        '''
+        import asyncio
+        if loop is None: loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+        if not self.server.up:
+            fut.set_exception(stream_cache_server_down())
+            return fut
+        a = self.source._get_parts(offset, size)
+        if all(b.kind != SCK_UNCACHED for b in a):
+            fut.set_result(a)
+            return fut
+        with self.lock:
+            self.waiters.append((offset, size, loop, fut))
+        for b in a:
+            if b.kind == SCK_UNCACHED: self.queue_load_(b.offset, b.size)
+        return fut
+
+    def notify_waiters_ (self, exc = None, failed = None):
+        '''
+        resolves the waiters whose range is cached; with exc, fails instead
+        the waiters overlapping the failed (offset, size) range (all of them
+        without one)
+        '''
+        with self.lock:
+            waiters = self.waiters
+            self.waiters = []
+        pending = []
+        for w in waiters:
+            offset, size, loop, fut = w
+            if exc is None:
+                a = self.source._get_parts(offset, size)
+                if any(b.kind == SCK_UNCACHED for b in a):
+                    pending.append(w)
+                    continue
+                loop.call_soon_threadsafe(set_future_result, fut, a)
+            elif failed is None or (offset < failed[0] + failed[1] and failed[0] < offset + size):
+                loop.call_soon_threadsafe(set_future_exception, fut, exc)
+            else:
+                pending.append(w)
+        if pending:
+            with self.lock:
+                self.waiters.extend(pending)
 
     def get_part (self, offset, size):
         b = self.source.get_part(offset, size)
@@ -461,19 +1595,45 @@ class stream_cache_proxy (stream_cache):
     def get_known_end_offset (self):
         return self.source.get_known_end_offset()
 
+    def stats (self):
+        d = self.source.stats()
+        with self.lock:
+            d.update(queued_bytes = self.queued_bytes, merged_bytes = self.merged_bytes)
+        return d
+
+    def load (self, offset, size):
+        '''
+        loads synchronously (used by cached_stream)
+        '''
+        self.source.load(offset, size)
+
     def queue_load_ (self, offset, size):
         if size == 0: return
         o = zlx.int.pow2_round_down(offset, self.source.align)
         e = zlx.int.pow2_round_up(offset + size, self.source.align)
         with self.lock:
             self.updated = False
+            self.queued_bytes += e - o
+            # union [o, e) with the pending requests it overlaps or touches
+            q = self.load_queue
+            i = bisect.bisect_left(q, (o, 0))
+            if i and q[i - 1].offset + q[i - 1].size >= o: i -= 1
+            j = i
+            pending = 0
+            while j < len(q) and q[j].offset <= e:
+                r_end = q[j].offset + q[j].size
+                pending += min(e, r_end) - max(o, q[j].offset)
+                o = min(o, q[j].offset)
+                e = max(e, r_end)
+                j += 1
+            self.merged_bytes += pending
             req = stream_cache_load_request(o, e - o)
-            if req in self.load_queue:
+            if j == i + 1 and q[i] == req:
                 dmsg('load request: {!r} already queued', req)
-            else:
-                dmsg('append load request: {!r}', req)
-                self.load_queue.append(req)
-                self.server.queue_stream_(self)
+                return
+            dmsg('queue load request: {!r}', req)
+            q[i:j] = [req]
+            self.server.queue_stream_(self)
 
     def reset_updated (self):
         with self.lock:
@@ -484,12 +1644,23 @@ class stream_cache_proxy (stream_cache):
     def work_ (self):
         dmsg('start work')
         if self.delay: time.sleep(self.delay)
-        while True:
-            size = 0
+        while self.server.up:
             with self.lock:
-                if not self.load_queue or not self.server.up: return
-                offset, size = self.load_queue.pop(0)
-            if size:
+                if not self.load_queue: return
+                batch = self.load_queue
+                self.load_queue = []
+            for offset, size in batch:
+                if not self.server.up: break
+                # source.load() only reads the parts still uncached
                 dmsg('loading o={:X} s={:X}', offset, size)
-                self.source.load(offset, size)
+                try:
+                    self.source.load(offset, size)
+                except Exception as e:
+                    # keep the worker alive; waiters on the range get the error
+                    emsg('stream_cache_proxy: failed loading o=0x{:X} s=0x{:X}: {}', offset, size, e)
+                    self.notify_waiters_(e, (offset, size))
+                    continue
                 self.updated = True
+                if self.waiters: self.notify_waiters_()
+        # shut down: the remaining loads will not happen
+        self.notify_waiters_(stream_cache_server_down())
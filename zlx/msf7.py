@@ -18,17 +18,28 @@ u32le       suttin
 u32le       dir_block_map_block
 ''', msf7_magic=zlx.wire.magic_codec('msf7_magic', MAGIC))
 
+dir_header_codec = zlx.wire.stream_record_codec('''
+msf_dir_header:
+u32le       stream_count
+''', zlx.wire.stream_record_field('stream_size_table',
+    zlx.wire.array_codec(zlx.wire.u32le, 'stream_count', compact = True), None))
+
 class reader (object):
     '''
     Provides read-only access to an MSF7 container file
     build it with:
         reader(file_path)   OR
+        reader(buffer)      OR      (bytes, memoryview from zlx.io.map_file()...)
         reader(stream)
+    When given a path the file is read with positional reads so streams
+    from the same reader can be used from different threads.
     '''
 
     def __init__ (self, source):
         if isinstance(source, str):
-            self.stream = open(source, 'rb')
+            self.stream = zlx.io.pread_stream(source)
+        elif isinstance(source, zlx.wire.BUFFER_TYPES):
+            self.stream = zlx.io.ba_view(source)
         else:
             self.stream = source
         self.superblock = superblock_codec.decode(self.stream)
@@ -51,7 +62,8 @@ class reader (object):
             self.stream.seek(self.superblock.dir_block_map_block * self.superblock.block_size)
             self.dir_blocks = zlx.wire.stream_decode_array(self.stream,
                     zlx.wire.u32le,
-                    self.size_to_blocks(self.superblock.dir_size))
+                    self.size_to_blocks(self.superblock.dir_size),
+                    compact = True)
             self.dir_stream = zlx.wire.stream(
                 zlx.io.chunked_stream((
                     zlx.io.chunk(
@@ -59,17 +71,23 @@ class reader (object):
                         block * self.superblock.block_size,
                         self.superblock.block_size) \
                     for block in self.dir_blocks)))
-            self.stream_count = self.dir_stream.u32le.read()
-            self.stream_size_table = self.dir_stream.u32le.read(self.stream_count)
+            dir_header = dir_header_codec.decode(self.dir_stream)
+            self.stream_count = dir_header.stream_count
+            self.stream_size_table = dir_header.stream_size_table
+            # block lists of all streams follow back to back: read them at once
+            block_counts = [self.size_to_blocks(stream_size) for stream_size in self.stream_size_table]
+            stream_blocks = self.dir_stream.u32le.read(sum(block_counts), compact = True)
             self.streams = []
-            for stream_size in self.stream_size_table:
+            bx = 0
+            for block_count in block_counts:
                 s = zlx.wire.stream(
                         zlx.io.chunked_stream((
                         zlx.io.chunk(self.stream,
                             block * self.superblock.block_size,
                             self.superblock.block_size) \
-                        for block in self.dir_stream.u32le.read(self.size_to_blocks(stream_size)))))
+                        for block in stream_blocks[bx : bx + block_count])))
                 self.streams.append(s)
+                bx += block_count
             #self.dir_stream.seek(0)
             #dir_data = self.dir_stream.read()
             #print('stream dir:\n{}'.format(zlx.bin.hex_char_dump(dir_data)))
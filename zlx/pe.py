@@ -1,3 +1,5 @@
+import struct
+
 import zlx.record
 import zlx.bin
 import zlx.io
@@ -132,119 +134,83 @@ SectionHeader = zlx.record.make('SectionHeader', '''
         name vsize rva fsize fpos
         reloc_fpos line_fpos reloc_count line_count flags''')
 
+FILE_HEADER_STRUCT = struct.Struct('<HHIIIHH')
+DATA_DIRECTORIES_STRUCT = struct.Struct('<32I') # 16 x (rva, size)
+OPT_HDR32_STRUCT = struct.Struct('<HBB9I6H4IHH6I')
+OPT_HDR64_STRUCT = struct.Struct('<HBB5IQ2I6H4IHH4Q2I')
+OPT_HDR_MAX_SIZE = OPT_HDR64_STRUCT.size + DATA_DIRECTORIES_STRUCT.size
+SECTION_HEADER_STRUCT = struct.Struct('<8sIIIIIIHHI')
+
+def read_header (ba, offset, size):
+    '''
+    reads the bytes of a header with a single access to ba
+    '''
+    data = ba[offset, size]
+    if len(data) < size: raise zlx.wire.decode_error('truncated data')
+    return data
+
+def decode_file_header (data, pos = 0):
+    return FileHeader(*FILE_HEADER_STRUCT.unpack_from(data, pos))
+
+def decode_data_directories (data, pos):
+    d = DATA_DIRECTORIES_STRUCT.unpack_from(data, pos)
+    return tuple(DataDirectory(rva = d[i], size = d[i + 1]) for i in range(0, 32, 2))
+
+def decode_optional_header (data, pos = 0):
+    '''
+    decodes the optional header (with its 16 data directories) from data
+    '''
+    magic, = struct.unpack_from('<H', data, pos)
+    if magic == OPT_HDR32_MAGIC:
+        rec_type, st = OptionalHeader32, OPT_HDR32_STRUCT
+    elif magic == OPT_HDR64_MAGIC:
+        rec_type, st = OptionalHeader64, OPT_HDR64_STRUCT
+    else:
+        return UnknownOptionalHeader(magic)
+    if len(data) - pos < st.size + DATA_DIRECTORIES_STRUCT.size:
+        raise zlx.wire.decode_error('truncated data')
+    oh = rec_type(*st.unpack_from(data, pos))
+    oh.dir = decode_data_directories(data, pos + st.size)
+    return oh
+
 def parse_file_header (ba, offset):
-    return FileHeader(
-        machine                 = ba.u16le[offset + 0x00],
-        section_count           = ba.u16le[offset + 0x02],
-        timestamp               = ba.u32le[offset + 0x04],
-        symbol_table_offset     = ba.u32le[offset + 0x08],
-        symbol_count            = ba.u32le[offset + 0x0C],
-        opt_hdr_size            = ba.u16le[offset + 0x10],
-        flags                   = ba.u16le[offset + 0x12])
+    return decode_file_header(read_header(ba, offset, FILE_HEADER_STRUCT.size))
 
 def parse_data_directory (ba, offset):
-    return DataDirectory(rva = ba.u32le[offset], size = ba.u32le[offset + 4])
+    return DataDirectory(*ba.u32le[offset, 2])
 
 def parse_optional_header32 (ba, offset):
-    oh = OptionalHeader32(
-        magic                           = ba.u16le[offset + 0x00],
-        major_linker_version            = ba. u8  [offset + 0x02],
-        minor_linker_version            = ba. u8  [offset + 0x03],
-        size_of_code                    = ba.u32le[offset + 0x04],
-        size_of_initialized_data        = ba.u32le[offset + 0x08],
-        size_of_uninitialized_data      = ba.u32le[offset + 0x0C],
-        entry_point                     = ba.u32le[offset + 0x10],
-        base_of_code                    = ba.u32le[offset + 0x14],
-        base_of_data                    = ba.u32le[offset + 0x18],
-        image_base                      = ba.u32le[offset + 0x1C],
-        section_alignment               = ba.u32le[offset + 0x20],
-        file_alignment                  = ba.u32le[offset + 0x24],
-        major_operating_system_version  = ba.u16le[offset + 0x28],
-        minor_operating_system_version  = ba.u16le[offset + 0x2A],
-        major_image_version             = ba.u16le[offset + 0x2C],
-        minor_image_version             = ba.u16le[offset + 0x2E],
-        major_subsystem_version         = ba.u16le[offset + 0x30],
-        minor_subsystem_version         = ba.u16le[offset + 0x32],
-        win32_version_value             = ba.u32le[offset + 0x34],
-        size_of_image                   = ba.u32le[offset + 0x38],
-        size_of_headers                 = ba.u32le[offset + 0x3C],
-        checksum                        = ba.u32le[offset + 0x40],
-        subsystem                       = ba.u16le[offset + 0x44],
-        dll_characteristics             = ba.u16le[offset + 0x46],
-        size_of_stack_reserve           = ba.u32le[offset + 0x48],
-        size_of_stack_commit            = ba.u32le[offset + 0x4C],
-        size_of_heap_reserve            = ba.u32le[offset + 0x50],
-        size_of_heap_commit             = ba.u32le[offset + 0x54],
-        loader_flags                    = ba.u32le[offset + 0x58],
-        dir_count                       = ba.u32le[offset + 0x5C])
-    oh.dir = tuple(parse_data_directory(ba, offset + 0x60 + 8 * i) for i in range(16))
-    return oh
+    return decode_optional_header(read_header(ba, offset, OPT_HDR32_STRUCT.size + DATA_DIRECTORIES_STRUCT.size))
 
 def parse_optional_header64 (ba, offset):
-    oh = OptionalHeader64(
-        magic                           = ba.u16le[offset + 0x00],
-        major_linker_version            = ba. u8  [offset + 0x02],
-        minor_linker_version            = ba. u8  [offset + 0x03],
-        size_of_code                    = ba.u32le[offset + 0x04],
-        size_of_initialized_data        = ba.u32le[offset + 0x08],
-        size_of_uninitialized_data      = ba.u32le[offset + 0x0C],
-        address_of_entry_point          = ba.u32le[offset + 0x10],
-        base_of_code                    = ba.u32le[offset + 0x14],
-        image_base                      = ba.u64le[offset + 0x18],
-        section_alignment               = ba.u32le[offset + 0x20],
-        file_alignment                  = ba.u32le[offset + 0x24],
-        major_operating_system_version  = ba.u16le[offset + 0x28],
-        minor_operating_system_version  = ba.u16le[offset + 0x2A],
-        major_image_version             = ba.u16le[offset + 0x2C],
-        minor_image_version             = ba.u16le[offset + 0x2E],
-        major_subsystem_version         = ba.u16le[offset + 0x30],
-        minor_subsystem_version         = ba.u16le[offset + 0x32],
-        win32_version_value             = ba.u32le[offset + 0x34],
-        size_of_image                   = ba.u32le[offset + 0x38],
-        size_of_headers                 = ba.u32le[offset + 0x3C],
-        checksum                        = ba.u32le[offset + 0x40],
-        subsystem                       = ba.u16le[offset + 0x44],
-        dll_characteristics             = ba.u16le[offset + 0x46],
-        size_of_stack_reserve           = ba.u32le[offset + 0x48],
-        size_of_stack_commit            = ba.u64le[offset + 0x50],
-        size_of_heap_reserve            = ba.u64le[offset + 0x58],
-        size_of_heap_commit             = ba.u64le[offset + 0x60],
-        loader_flags                    = ba.u32le[offset + 0x68],
-        dir_count                       = ba.u32le[offset + 0x6C])
-    oh.dir = tuple(parse_data_directory(ba, offset + 0x60 + 8 * i) for i in range(16))
-    return oh
+    return decode_optional_header(read_header(ba, offset, OPT_HDR_MAX_SIZE))
 
 def parse_optional_header (ba, offset):
-    opt_hdr_magic = ba.u16le[offset]
-    if opt_hdr_magic == OPT_HDR32_MAGIC:
-        oh = parse_optional_header32(ba, offset)
-    elif opt_hdr_magic == OPT_HDR64_MAGIC:
-        oh = parse_optional_header64(ba, offset)
-    else:
-        oh = UnknownOptionalHeader(opt_hdr_magic)
-    return oh
+    data = ba[offset, OPT_HDR_MAX_SIZE]
+    if len(data) < 2: raise zlx.wire.decode_error('truncated data')
+    return decode_optional_header(data)
 
 def parse_section_header (ba, offset):
-    return SectionHeader(
-        name = ba[offset, 8],
-        vsize = ba.u32le[offset + 0x08],
-        rva = ba.u32le[offset + 0x0C],
-        fsize = ba.u32le[offset + 0x10],
-        fpos = ba.u32le[offset + 0x14],
-        reloc_fpos = ba.u32le[offset + 0x18],
-        line_fpos = ba.u32le[offset + 0x1C],
-        reloc_count = ba.u16le[offset + 0x20],
-        line_count = ba.u16le[offset + 0x22],
-        flags = ba.u32le[offset + 0x24])
+    return SectionHeader(*SECTION_HEADER_STRUCT.unpack(read_header(ba, offset, SECTION_HEADER_STRUCT.size)))
+
+def parse_section_table (ba, offset, count):
+    '''
+    decodes count section headers with a single read
+    '''
+    data = read_header(ba, offset, count * SECTION_HEADER_STRUCT.size)
+    return tuple(SectionHeader(*t) for t in zlx.wire.buffer_iter_unpack(SECTION_HEADER_STRUCT, data))
 
 def parse_pe_header (ba, offset):
-    peh = PEHeader(magic = ba.u32le[offset])
-    peh.file_hdr = parse_file_header(ba, offset + 4)
+    '''
+    parses the PE signature, file header, optional header and section
+    table with one read for each of the three parts
+    '''
+    data = read_header(ba, offset, 4 + FILE_HEADER_STRUCT.size)
+    peh = PEHeader(magic = struct.unpack_from('<I', data)[0])
+    peh.file_hdr = decode_file_header(data, 4)
     peh.opt_hdr = parse_optional_header(ba, offset + 24)
-    peh.sec = tuple(
-        parse_section_header(ba,
-            offset + 0x18 + peh.file_hdr.opt_hdr_size + i * 0x28)
-        for i in range(peh.file_hdr.section_count))
+    peh.sec = parse_section_table(ba,
+            offset + 0x18 + peh.file_hdr.opt_hdr_size, peh.file_hdr.section_count)
     return peh
 
 def map_parsed_pe (ba, peh, arch_page_size = 4096):
@@ -269,7 +235,7 @@ def map_parsed_pe (ba, peh, arch_page_size = 4096):
     return image
 
 def map_pe_from_path (path, arch_page_size = 4096):
-    ba = zlx.wire.stream(zlx.io.bin_load(path))
+    ba = zlx.wire.stream(zlx.io.map_file(path))
     mzh = parse_mz_header(ba)
     peh = parse_pe_header(ba, offset = mzh.e_lfanew)
     return map_parsed_pe(ba, peh, arch_page_size)
@@ -1,5 +1,5 @@
 import zlx.record
-import zlx.bin
+import zlx.wire
 import zlx.int
 
 DUMP32_MAGIC = b'PAGEDUMP'
@@ -36,8 +36,8 @@ Header = zlx.record.make('WinDumpHeader', '''
         ))
 
 def parse_header (data):
-    if isinstance(data, zlx.bin.io_accessor): ba = data
-    else: ba = zlx.bin.io_accessor(data)
+    if isinstance(data, zlx.wire.stream): ba = data
+    else: ba = zlx.wire.stream(data)
     h = Header(magic = ba[0, 8])
     if h.magic == DUMP32_MAGIC:
         h.ver_major = ba.u32le[0x08]
@@ -1,5 +1,9 @@
 from __future__ import absolute_import
+import array
+import mmap
+import operator
 import struct
+import sys
 import io
 
 import zlx.int
@@ -12,6 +16,8 @@ SEEK_END = 2
 
 class decode_error (RuntimeError): pass
 
+class encode_error (RuntimeError): pass
+
 PACK_FMT_DICT = {
     'u8': 'B',
     'i8': 'b',
@@ -42,25 +48,61 @@ def register_codec (codec):
 
 
 class stream_codec (object):
+    '''
+    Codec described by a decode(stream) and an encode(stream, value) function.
+    pack_fmt is set for codecs of fixed-width integers (see PACK_FMT_DICT)
+    and allows record codecs to fuse consecutive fields into one struct.
+    '''
 
-    __slots__ = 'decode encode name desc'.split()
+    __slots__ = 'decode encode name desc pack_fmt'.split()
 
-    def __init__ (self, name, decode, encode, desc = default_desc, register = True):
+    def __init__ (self, name, decode, encode, desc = default_desc, register = True, pack_fmt = None):
         self.name = name
         self.decode = decode
         self.encode = encode
         self.desc = desc
+        self.pack_fmt = pack_fmt
         if register: register_codec(self)
 
     def encode_to_bytes (self, value):
+        if self.pack_fmt is not None:
+            return struct.pack(self.pack_fmt, value)
         f = io.BytesIO()
         self.encode(f, value)
         return f.getvalue()
 
+    def encode_into (self, buffer, values, offset = 0):
+        '''
+        encodes all values into a writable buffer (bytearray, memoryview...)
+        starting at offset; returns the number of bytes written.
+        Integer codecs are packed with struct.pack_into() in large batches.
+        '''
+        if self.pack_fmt is None:
+            return buffer_encode_copy(self, buffer, values, offset)
+        order, ch = split_pack_fmt(self.pack_fmt)
+        width = struct.calcsize(self.pack_fmt)
+        o = offset
+        try:
+            for i in range(0, len(values), ENCODE_BATCH_SIZE):
+                batch = values[i : i + ENCODE_BATCH_SIZE]
+                struct.pack_into('{}{}{}'.format(order or '<', len(batch), ch), buffer, o, *batch)
+                o += len(batch) * width
+        except struct.error as e:
+            raise encode_error(str(e))
+        return o - offset
+
     def decode_from_bytes (self, data):
         f = encoded_stream(data, self)
         return f.read()
 
+    def iter_decode (self, stream, count = None, chunk_size = zlx.io.READ_AHEAD_SIZE):
+        '''
+        generator decoding values until EOF or until count values are decoded
+        '''
+        if self.pack_fmt is None:
+            return stream_iter_decode(stream, self, count, chunk_size)
+        return (t[0] for t in stream_iter_unpack(stream, struct.Struct(self.pack_fmt), count, chunk_size))
+
 
 def stream_decode_unpack (stream, pack_fmt, pack_len):
     data = stream.read(pack_len)
@@ -81,8 +123,142 @@ def stream_decode_copy (stream, size, throw_on_no_match = True):
 def stream_encode_copy (stream, value):
     stream.write(value)
 
-def stream_decode_array (stream, codec, count):
-    return tuple(codec.decode(stream) for i in range(count))
+def find_array_typecode (pack_char):
+    '''
+    returns the array.array typecode holding items of the same signedness
+    and width as the given struct type char or None if there is none
+    '''
+    width = struct.calcsize('<' + pack_char)
+    for tc in (pack_char.lower() + 'hilq') if pack_char.islower() else (pack_char + 'HILQ'):
+        try:
+            if array.array(tc).itemsize == width: return tc
+        except ValueError:
+            pass
+    return None
+
+ARRAY_TYPECODES = { ch: find_array_typecode(ch) for ch in 'bBhHiIqQ' }
+
+NATIVE_BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+def unpack_array (data, pack_fmt, count, compact = False):
+    '''
+    decodes count integers described by pack_fmt from data.
+    Returns a tuple of ints or, if compact is set, an array.array (falls back
+    to a tuple if the platform has no array type with the right width)
+    '''
+    order, ch = split_pack_fmt(pack_fmt)
+    if compact:
+        tc = ARRAY_TYPECODES.get(ch)
+        if tc is not None:
+            a = array.array(tc)
+            if hasattr(a, 'frombytes'): a.frombytes(data)
+            else: a.fromstring(bytes(data))
+            if order is not None and order != NATIVE_BYTE_ORDER and a.itemsize > 1:
+                a.byteswap()
+            return a
+    return struct.unpack('{}{}{}'.format(order or '<', count, ch), data)
+
+def buffer_iter_unpack (st, data, offset = 0, count = None):
+    '''
+    iterates over tuples unpacked with the struct.Struct st from count
+    consecutive items in data starting at offset (all complete items if
+    count is None)
+    '''
+    if count is None: count = (len(data) - offset) // st.size
+    end = offset + count * st.size
+    if end > len(data): raise decode_error('truncated data')
+    if hasattr(st, 'iter_unpack'):
+        return st.iter_unpack(memoryview(data)[offset : end])
+    return (st.unpack_from(data, o) for o in range(offset, end, st.size))
+
+def stream_decode_array (stream, codec, count, compact = False):
+    '''
+    decodes count items with the given codec.
+    Integer codecs are decoded in bulk: a single read of count * width bytes
+    followed by one unpack; compact = True returns an array.array instead
+    of a tuple for those.
+    '''
+    pack_fmt = getattr(codec, 'pack_fmt', None)
+    if pack_fmt is None:
+        return tuple(codec.decode(stream) for i in range(count))
+    size = count * struct.calcsize(pack_fmt)
+    data = stream.read(size) if size else b''
+    if data is None or len(data) != size:
+        raise decode_error('truncated data')
+    return unpack_array(data, pack_fmt, count, compact)
+
+def stream_read_full (stream, size):
+    '''
+    reads size bytes, retrying on short reads; returns less only at EOF
+    '''
+    data = stream.read(size) or b''
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more: break
+        data += more
+    return data
+
+def stream_iter_unpack (stream, st, count = None, chunk_size = zlx.io.READ_AHEAD_SIZE):
+    '''
+    generator yielding tuples unpacked with the struct.Struct st from
+    consecutive items in stream; reads chunk_size bytes at a time
+    '''
+    per_chunk = max(1, chunk_size // st.size)
+    n = 0
+    while count is None or n < count:
+        k = per_chunk if count is None else min(per_chunk, count - n)
+        size = k * st.size
+        data = stream_read_full(stream, size)
+        for o in range(0, len(data) - st.size + 1, st.size):
+            yield st.unpack_from(data, o)
+        n += len(data) // st.size
+        if len(data) < size:
+            if len(data) % st.size or (count is not None and n < count):
+                raise decode_error('truncated data')
+            return
+
+def stream_iter_decode (stream, codec, count = None, chunk_size = zlx.io.READ_AHEAD_SIZE):
+    '''
+    generator decoding with any codec from a zlx.io.read_ahead_stream over
+    the given stream. On exit, the stream is positioned (if seekable) right
+    after the last decoded item.
+    '''
+    ras = zlx.io.read_ahead_stream(stream, chunk_size)
+    try:
+        n = 0
+        while count is None or n < count:
+            if count is None and not ras.fill(1): return
+            yield codec.decode(ras)
+            n += 1
+    finally:
+        ras.release()
+
+ENCODE_BATCH_SIZE = 0x10000
+
+def buffer_encode_copy (codec, buffer, values, offset):
+    '''
+    encodes values with the codec's stream encoder and copies the result
+    into buffer at offset; returns the number of bytes written
+    '''
+    f = io.BytesIO()
+    for v in values: codec.encode(f, v)
+    data = f.getbuffer() if hasattr(f, 'getbuffer') else f.getvalue()
+    if offset < 0 or len(buffer) - offset < len(data):
+        raise encode_error('buffer too small')
+    buffer[offset : offset + len(data)] = data
+    return len(data)
+
+def stream_encode_array (stream, codec, items):
+    '''
+    encodes all items with the given codec; integer codecs are packed with
+    a single struct.pack() call
+    '''
+    pack_fmt = getattr(codec, 'pack_fmt', None)
+    if pack_fmt is None:
+        for item in items: codec.encode(stream, item)
+        return
+    order, ch = split_pack_fmt(pack_fmt)
+    stream.write(struct.pack('{}{}{}'.format(order or '<', len(items), ch), *items))
 
 def dec_hex_int_desc (value):
     return '{0}(0x{0:X})'.format(value)
@@ -93,26 +269,50 @@ for codec_name in PACK_FMT_DICT:
             name = codec_name,
             decode = lambda stream, pack_fmt=PACK_FMT_DICT[codec_name], pack_len=len(struct.pack(PACK_FMT_DICT[codec_name], 0)): stream_decode_unpack(stream, pack_fmt, pack_len),
             encode = lambda stream, value, pack_fmt=PACK_FMT_DICT[codec_name]: stream_encode_pack(stream, value, pack_fmt),
-            desc = dec_hex_int_desc)
+            desc = dec_hex_int_desc,
+            pack_fmt = PACK_FMT_DICT[codec_name])
     globals()[codec_name] = codec
     INT_CODECS.append(codec)
 
+class byte_seq_matcher (object):
+    '''
+    Longest-prefix matcher for a collection of byte sequences (or a dict
+    mapping byte sequences to values). Sequences are grouped by length in
+    dicts so matching costs one lookup per distinct length instead of one
+    comparison per sequence.
+    '''
+    __slots__ = 'by_len lengths max_len'.split()
+
+    def __init__ (self, byte_seq_map):
+        by_len = {}
+        for k in byte_seq_map:
+            v = byte_seq_map[k] if isinstance(byte_seq_map, dict) else k
+            by_len.setdefault(len(k), {})[bytes(k)] = v
+        self.by_len = by_len
+        self.lengths = tuple(sorted(by_len, reverse = True))
+        self.max_len = self.lengths[0]
+
+    def match (self, data):
+        '''
+        returns (match_len, value) for the longest sequence data starts with
+        or (None, None) if there is no match
+        '''
+        for l in self.lengths:
+            if l <= len(data):
+                d = self.by_len[l]
+                k = data[0:l]
+                if k in d: return l, d[k]
+        return None, None
+
 def stream_decode_byte_seq_map (stream, byte_seq_map, throw_on_no_match = True):
-    max_len = max(len(k) for k in byte_seq_map)
-    data = stream.read(max_len)
-    match = None
-    for k in byte_seq_map:
-        if data[0:len(k)] == k:
-            if match is None or len(k) > len(match):
-                match = k
-    if match is None:
+    if not isinstance(byte_seq_map, byte_seq_matcher):
+        byte_seq_map = byte_seq_matcher(byte_seq_map)
+    data = stream.read(byte_seq_map.max_len) or b''
+    match_len, match = byte_seq_map.match(data)
+    if match_len is None:
         if throw_on_no_match: raise decode_error('no match')
         match_len = 0
-    else:
-        match_len = len(match)
-        if isinstance(byte_seq_map, dict):
-            match = byte_seq_map[match]
-    stream.seek(match_len - max_len, 1)
+    stream.seek(match_len - len(data), 1)
     return match
 
 def magic_codec (name, *magic_list):
@@ -123,15 +323,198 @@ def magic_codec (name, *magic_list):
         register = True
     return stream_codec(
             name = name,
-            decode = lambda stream, _map = magic_list: stream_decode_byte_seq_map(stream, _map),
+            decode = lambda stream, _map = byte_seq_matcher(magic_list): stream_decode_byte_seq_map(stream, _map),
             encode = stream_encode_copy,
             register = register)
 
 stream_record_field = zlx.record.make('record_field', 'name codec desc')
 
+def split_pack_fmt (pack_fmt):
+    '''
+    splits a pack format into (byte_order, type_chars); byte_order is None
+    when the format does not specify one (single byte types)
+    '''
+    if pack_fmt[0] in '<>=!@':
+        return pack_fmt[0], pack_fmt[1:]
+    return None, pack_fmt
+
+#* dependent field codecs ***************************************************/
+class array_codec (object):
+    '''
+    record field codec for an array of items of the given codec; count is
+    either a number or the name of an earlier (integer) field of the record.
+    Integer arrays are read with one read (see stream_decode_array).
+    In record specs: "u32le[count_field] name" or "u32le[16] name"
+    '''
+    __slots__ = 'codec count compact desc'.split()
+    def __init__ (self, codec, count, compact = False):
+        self.codec = codec
+        self.count = count
+        self.compact = compact
+        self.desc = lambda v, d = codec.desc or default_desc: '[{}]'.format(', '.join(d(x) for x in v))
+
+class blob_codec (object):
+    '''
+    record field codec for a byte string; size is either a number or the
+    name of an earlier (integer) field of the record.
+    In record specs: "bytes[size_field] name" or "bytes[8] name"
+    '''
+    __slots__ = 'size pack_fmt desc'.split()
+    def __init__ (self, size):
+        self.size = size
+        self.pack_fmt = '{}s'.format(size) if isinstance(size, zlx.int.INT_TYPES) else None
+        self.desc = default_desc
+
+class align_codec (object):
+    '''
+    record padding up to the given alignment, relative to the record start;
+    it does not produce a record field.
+    In record specs: "align[4]"
+    '''
+    __slots__ = 'alignment desc'.split()
+    def __init__ (self, alignment):
+        self.alignment = alignment
+        self.desc = None
+
+def codec_static_size (codec):
+    '''
+    returns the encoded size of any value of the codec or None if it varies
+    '''
+    pack_fmt = getattr(codec, 'pack_fmt', None)
+    if pack_fmt is not None: return struct.calcsize(pack_fmt)
+    if isinstance(codec, array_codec) and isinstance(codec.count, zlx.int.INT_TYPES):
+        item_size = codec_static_size(codec.codec)
+        return None if item_size is None else item_size * codec.count
+    size = getattr(codec, 'size', None)
+    return size if isinstance(size, zlx.int.INT_TYPES) else None
+
+def parse_field_codec (spec, codec_map):
+    '''
+    parses the codec part of a record spec line: codec_name, codec_name[count],
+    bytes[size] or align[alignment]
+    '''
+    if '[' not in spec:
+        return codec_map[spec] if spec in codec_map else CODEC_REGISTRY[spec]
+    if not spec.endswith(']'):
+        raise RuntimeError('bad record spec - bad field type {!r}'.format(spec))
+    base, arg = (x.strip() for x in spec[0:-1].split('[', 1))
+    if arg[0:1].isdigit(): arg = int(arg, 0)
+    if base == 'align': return align_codec(arg)
+    if base == 'bytes': return blob_codec(arg)
+    return array_codec(parse_field_codec(base, codec_map), arg)
+
+def plan_record_fields (fields):
+    '''
+    computes how a record is decoded. Consecutive fields with fixed-width
+    codecs (those having pack_fmt) and padding at known offsets are fused
+    in a single precompiled struct.Struct.
+    Returns (steps, field_offsets, size) where steps is a tuple of:
+        (struct.Struct, (field_name, ...))  for fused runs
+        (None, field)                       for all other fields
+    field_offsets maps field names to their offset from the record start
+    (None if it depends on the content of earlier fields) and size is the
+    record size (None if variable)
+    '''
+    steps = []
+    field_offsets = {}
+    offset = 0
+    run = [None, '', []] # byte order, struct format, field names
+    def flush ():
+        if run[1]:
+            steps.append((struct.Struct((run[0] or '<') + run[1]), tuple(run[2])))
+        run[:] = [None, '', []]
+    for f in fields:
+        c = f.codec
+        for ref in (getattr(c, 'count', None), getattr(c, 'size', None)):
+            if isinstance(ref, str) and ref not in field_offsets:
+                raise RuntimeError('bad record spec - {!r} is not an earlier field'.format(ref))
+        if isinstance(c, align_codec):
+            if offset is None:
+                flush()
+                steps.append((None, f))
+            else:
+                pad = -offset % c.alignment
+                if pad: run[1] += '{}x'.format(pad)
+                offset += pad
+            continue
+        field_offsets[f.name] = offset
+        pack_fmt = getattr(c, 'pack_fmt', None)
+        if pack_fmt is None:
+            flush()
+            steps.append((None, f))
+            if offset is not None:
+                size = codec_static_size(c)
+                offset = None if size is None else offset + size
+            continue
+        order, fmt = split_pack_fmt(pack_fmt)
+        if order is not None and run[0] is not None and order != run[0]:
+            flush()
+        if order is not None: run[0] = order
+        run[1] += fmt
+        run[2].append(f.name)
+        if offset is not None: offset += struct.calcsize(pack_fmt)
+    flush()
+    return tuple(steps), field_offsets, offset
+
+#* record_view **************************************************************/
+class lazy_record_field (object):
+    '''
+    descriptor that decodes a field of a record_view on access; when the
+    view caches, the value is stored in the instance dict which then
+    shadows this descriptor
+    '''
+    __slots__ = 'name unpack_from offset'.split()
+
+    def __init__ (self, name, unpack_from, offset):
+        self.name = name
+        self.unpack_from = unpack_from
+        self.offset = offset
+
+    def __get__ (self, view, owner):
+        if view is None: return self
+        value = self.unpack_from(view._buffer, view._offset + self.offset)[0]
+        if view._cache: view.__dict__[self.name] = value
+        return value
+
+class record_view (object):
+    '''
+    Lazy view of a fixed-size record found in a buffer at a given offset.
+    Fields are decoded when accessed. Subclasses are created by
+    stream_record_codec for records with only fixed-width fields.
+    '''
+
+    def __init__ (self, buffer, offset = 0, cache = True):
+        if offset < 0 or len(buffer) - offset < self._size:
+            raise decode_error('truncated data')
+        self._buffer = buffer
+        self._offset = offset
+        self._cache = cache
+
+    def to_record (self):
+        return self._record_type(*[getattr(self, f) for f in self._record_type.__slots__])
+
+    def __repr__ (self):
+        return repr(self.to_record())
+
+def make_record_view_type (name, record_type, fields, field_offsets, size):
+    attrs = dict(_record_type = record_type, _size = size)
+    for f in fields:
+        if f.name is None: continue
+        unpack_from = struct.Struct(f.codec.pack_fmt).unpack_from
+        attrs[f.name] = lazy_record_field(f.name, unpack_from, field_offsets[f.name])
+    return type(name + '_view', (record_view,), attrs)
+
 #* stream_record_codec ******************************************************/
 class stream_record_codec (object):
-    __slots__ = 'name fields record_type'.split()
+    '''
+    Codec for records described by a list of fields or by a spec like:
+        name:
+            u32le       count       # "type name" or "name: type"
+            u16le[count] items      # array sized by an earlier field
+            bytes[8]    tag         # byte string (fixed or sized by a field)
+            align[4]                # padding relative to the record start
+    '''
+    __slots__ = 'name fields record_type steps field_offsets field_index track_pos size view_type fixed_blobs'.split()
     def __init__ (self, name_or_spec, *fields, **kw):
         if '\n' in name_or_spec:
             name = None
@@ -147,9 +530,13 @@ class stream_record_codec (object):
                 else:
                     if ':' in line:
                         fn, fc = (x.strip() for x in line.split(':', 1))
+                    elif line.startswith('align[') and len(line.split()) == 1:
+                        fc, fn = line, None
+                    elif len(line.split()) != 2:
+                        raise RuntimeError('bad record spec - expecting "type name", got {!r}'.format(line))
                     else:
                         fc, fn = line.split()
-                    codec = kw[fc] if fc in kw else CODEC_REGISTRY[fc]
+                    codec = parse_field_codec(fc, kw)
                     field = stream_record_field(fn, codec, codec.desc)
                     fl.append(field)
             fl.extend(fields)
@@ -161,31 +548,144 @@ class stream_record_codec (object):
         fields = tuple(fields)
         self.fields = fields
         #print(repr(tuple((f.name for f in fields))))
+        field_names = tuple(f.name for f in fields if f.name is not None)
         self.record_type = zlx.record.make(name,
-            fields = tuple(f.name for f in fields),
-            field_repr = { f.name: f.desc or default_desc for f in fields })
+            fields = field_names,
+            field_repr = { f.name: f.desc or default_desc for f in fields if f.name is not None })
+        self.field_index = { n: i for i, n in enumerate(field_names) }
+        self.steps, self.field_offsets, self.size = plan_record_fields(fields)
+        self.track_pos = any(st is None and isinstance(f.codec, align_codec) for st, f in self.steps)
+        # fixed size blobs fused in structs: struct.pack would pad / truncate them
+        self.fixed_blobs = tuple(f for f in fields
+                if isinstance(f.codec, blob_codec) and f.codec.pack_fmt is not None)
+        if all(st is not None for st, f in self.steps):
+            self.view_type = make_record_view_type(name, self.record_type, fields, self.field_offsets, self.size)
+        else:
+            self.view_type = None
         register_codec(self)
 
+    def view (self, source, offset = 0, cache = True):
+        '''
+        returns a lazy view of the record found in source at given offset;
+        fields are decoded on first access (and cached if cache is set).
+        source can be a buffer, a zlx.wire.stream over a buffer or any other
+        stream in which case the record is read from its current position
+        (offset is ignored). Only records made of fixed-width fields support
+        views.
+        '''
+        if self.view_type is None:
+            raise RuntimeError('record {} has variable size fields'.format(self.name))
+        if isinstance(source, stream) and source.buffer is not None:
+            source = source.buffer
+        elif not isinstance(source, BUFFER_TYPES):
+            source = source.read(self.size) or b''
+            offset = 0
+        return self.view_type(source, offset, cache)
+
+    def iter_decode (self, stream, count = None, chunk_size = zlx.io.READ_AHEAD_SIZE):
+        '''
+        generator decoding records until EOF or until count records are
+        decoded; the stream is read in chunks of about chunk_size bytes
+        '''
+        if len(self.steps) == 1 and self.steps[0][0] is not None:
+            record_type = self.record_type
+            return (record_type(*t) for t in stream_iter_unpack(stream, self.steps[0][0], count, chunk_size))
+        return stream_iter_decode(stream, self, count, chunk_size)
+
     def decode (self, stream):
-        return self.record_type(**{f.name: f.codec.decode(stream) for f in self.fields})
+        values = []
+        if self.track_pos: start = stream.seek(0, SEEK_CUR)
+        for st, f in self.steps:
+            if st is not None:
+                data = stream.read(st.size)
+                if not data or len(data) != st.size:
+                    raise decode_error('truncated data')
+                values.extend(st.unpack(data))
+                continue
+            c = f.codec
+            if c.__class__ is array_codec:
+                count = c.count if isinstance(c.count, zlx.int.INT_TYPES) else values[self.field_index[c.count]]
+                values.append(stream_decode_array(stream, c.codec, count, c.compact))
+            elif c.__class__ is blob_codec:
+                values.append(stream_decode_copy(stream, values[self.field_index[c.size]]))
+            elif c.__class__ is align_codec:
+                pad = (start - stream.seek(0, SEEK_CUR)) % c.alignment
+                if pad: stream_decode_copy(stream, pad)
+            else:
+                values.append(c.decode(stream))
+        return self.record_type(*values)
 
     def encode (self, stream, value):
-        for f in self.fields:
-            f.codec.encode(stream, getattr(value, f.name))
+        for f in self.fixed_blobs: self.check_length(value, f, getattr(value, f.name), f.codec.size)
+        if self.track_pos: start = stream.seek(0, SEEK_CUR)
+        for st, f in self.steps:
+            if st is not None:
+                stream.write(st.pack(*[getattr(value, n) for n in f]))
+                continue
+            c = f.codec
+            if c.__class__ is align_codec:
+                pad = (start - stream.seek(0, SEEK_CUR)) % c.alignment
+                if pad: stream.write(b'\0' * pad)
+                continue
+            v = getattr(value, f.name)
+            if c.__class__ is array_codec:
+                self.check_length(value, f, v, c.count)
+                stream_encode_array(stream, c.codec, v)
+            elif c.__class__ is blob_codec:
+                self.check_length(value, f, v, c.size)
+                stream.write(v)
+            else:
+                c.encode(stream, v)
+
+    def encode_into (self, buffer, values, offset = 0):
+        '''
+        encodes all records into a writable buffer (bytearray, memoryview...)
+        starting at offset; returns the number of bytes written.
+        Records made of fixed-width fields are written with
+        struct.pack_into(), others are encoded to a temporary stream first.
+        '''
+        if self.view_type is None:
+            return buffer_encode_copy(self, buffer, values, offset)
+        steps = []
+        step_offset = 0
+        for st, names in self.steps:
+            steps.append((st.pack_into, step_offset, operator.attrgetter(*names) if names else None, len(names)))
+            step_offset += st.size
+        o = offset
+        try:
+            for v in values:
+                for f in self.fixed_blobs: self.check_length(v, f, getattr(v, f.name), f.codec.size)
+                for pack_into, step_offset, getter, n in steps:
+                    if n > 1: pack_into(buffer, o + step_offset, *getter(v))
+                    elif n: pack_into(buffer, o + step_offset, getter(v))
+                    else: pack_into(buffer, o + step_offset)
+                o += self.size
+        except struct.error as e:
+            raise encode_error(str(e))
+        return o - offset
+
+    def check_length (self, record, field, value, length):
+        if not isinstance(length, zlx.int.INT_TYPES):
+            length = getattr(record, length)
+        if len(value) != length:
+            raise encode_error('{}.{}: expecting length {}, got {}'.format(
+                self.name, field.name, length, len(value)))
 
 
 #* encoded_stream ***********************************************************/
 class encoded_stream (object):
 
-    __slots = 'stream decode encode'.split()
+    __slots = 'stream codec decode encode'.split()
     def __init__ (self, stream, codec):
         self.stream = stream
+        self.codec = codec
         self.decode = codec.decode
         self.encode = codec.encode
 
-    def read (self, count = None):
+    def read (self, count = None, compact = False):
         if count is not None:
-            return [self.decode(self.stream) for i in range(count)]
+            a = stream_decode_array(self.stream, self.codec, count, compact)
+            return a if compact else list(a)
         return self.decode(self.stream)
 
     def write (self, value):
@@ -195,7 +695,7 @@ class encoded_stream (object):
         if isinstance(index, tuple):
             offset, count = index
             self.stream.seek(offset)
-            return tuple(self.decode(stream) for i in range(count))
+            return stream_decode_array(self.stream, self.codec, count)
         else:
             self.stream.seek(index)
             return self.decode(self.stream)
@@ -211,13 +711,54 @@ class encoded_stream (object):
         return end
 
 
+#* buffer_encoded_stream ****************************************************/
+class buffer_encoded_stream (encoded_stream):
+    '''
+    encoded_stream over an in-memory buffer: indexing integer codecs
+    decodes with struct.unpack_from() directly from the buffer, without
+    seeking or copying (and without moving the stream position).
+    '''
+
+    def __init__ (self, buffer, stream, codec):
+        encoded_stream.__init__(self, stream, codec)
+        self.buffer = buffer
+        pack_fmt = getattr(codec, 'pack_fmt', None)
+        self.unpack_from = struct.Struct(pack_fmt).unpack_from if pack_fmt else None
+
+    def __getitem__ (self, index):
+        if self.unpack_from is None:
+            return encoded_stream.__getitem__(self, index)
+        try:
+            if isinstance(index, tuple):
+                offset, count = index
+                if offset < 0: raise ValueError('negative offset')
+                order, ch = split_pack_fmt(self.codec.pack_fmt)
+                return struct.unpack_from('{}{}{}'.format(order or '<', count, ch), self.buffer, offset)
+            if index < 0: raise ValueError('negative offset')
+            return self.unpack_from(self.buffer, index)[0]
+        except struct.error:
+            raise decode_error('truncated data')
+
+
 #* stream *******************************************************************/
+BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
 class stream (object):
+    '''
+    Wraps a stream and exposes an encoded_stream attribute per codec:
+        s.u32le[offset], s.u16be[offset, count], s[offset, size]...
+    If given a buffer (bytes, bytearray, memoryview, mmap) indexing decodes
+    straight from the buffer; the buffer is also wrapped in a zlx.io.ba_view
+    for sequential access.
+    '''
 
     #__slots__ = 'stream codec_streams'.split()
     def __init__ (self, stream, *codec_list, **codec_map):
-        if isinstance(stream, (bytes, bytearray)):
+        if isinstance(stream, BUFFER_TYPES):
+            self.buffer = stream
             stream = zlx.io.ba_view(stream)
+        else:
+            self.buffer = None
         self.stream = stream
         if not codec_list and not codec_map:
             codec_map = CODEC_REGISTRY
@@ -230,15 +771,28 @@ class stream (object):
 
     def add_codec (self, codec, name = None):
         if name is None: name = codec.name
-        setattr(self, name, encoded_stream(self.stream, codec))
+        if self.buffer is not None:
+            setattr(self, name, buffer_encoded_stream(self.buffer, self.stream, codec))
+        else:
+            setattr(self, name, encoded_stream(self.stream, codec))
 
     def __len__ (self):
+        if self.buffer is not None:
+            return len(self.buffer)
         pos = self.stream.seek(0, SEEK_CUR)
         end = self.stream.seek(0, SEEK_END)
         self.stream.seek(pos, SEEK_SET)
         return end
 
     def __getitem__ (self, index):
+        if self.buffer is not None:
+            if isinstance(index, tuple):
+                offset, count = index
+                if offset < 0: raise ValueError('negative offset')
+                data = self.buffer[offset : offset + count]
+                return data.tobytes() if isinstance(data, memoryview) else data
+            if index < 0: raise ValueError('negative offset')
+            return self.buffer[index]
         if isinstance(index, tuple):
             offset, count = index
             self.stream.seek(offset)